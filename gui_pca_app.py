@@ -1,16 +1,92 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
-import numpy as np
 import matplotlib
 matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-import mplcursors
 import sys
+import os
 import ctypes
+import threading
+import queue
+import traceback
+
+from pca_core import (
+    PCA_SOLVERS, STREAMING_CHUNK_ROWS, STREAMING_THRESHOLD_BYTES,
+    AnalysisCancelled, DataError, DatasetCache,
+)
+from pca_cache import FitCache
+from pca_export import export_scores, model_dir_for_path, save_model
+from pca_sparse import category_source_path
+from pca_stability import DEFAULT_REPLICATES, STABILITY_METHODS, run_stability, stability_unsupported_reason
+from pca_plots import (
+    CATEGORY_COLORS, CATEGORY_MARKERS, LOADINGS_TOP_K, ScatterHover, apply_scatter_style, create_explained_variance_figure,
+    create_loadings_figure, create_scatter_figure, draw_loadings, draw_scatter_legend,
+)
+
+
+# --- 分析処理の段階 (進捗バーの表示用) ---
+ANALYSIS_STAGES = {
+    'reading': ("CSVを読み込み中...", 10),
+    'scaling': ("データを標準化中...", 35),
+    'fitting': ("主成分分析を実行中...", 60),
+    'projecting': ("主成分スコアを書き出し中...", 75),
+    'rendering': ("グラフを描画中...", 85),
+}
+WORKER_POLL_INTERVAL_MS = 100
+# ステータス表示用のステージ名 (ピークメモリの内訳)
+MEMORY_STAGE_LABELS = {'reading': '読込', 'scaling': '標準化', 'fitting': 'PCA', 'projecting': '射影'}
+
+def _format_peak_rss(peak_rss):
+    parts = [f"{MEMORY_STAGE_LABELS.get(stage, stage)} {value / 1024 ** 2:.0f}MB"
+             for stage, value in peak_rss.items() if value]
+    return ", ".join(parts)
+
+def _analysis_worker(file_path, dataset_cache, fit_cache, streaming_threshold_bytes, solver, low_memory, sparse_center, cancel_event,
+                     result_queue):
+    # --- Tkに触れずに 読み込み → 標準化 → PCA を行い、結果をキューで返す ---
+    last_stage = [None]
+
+    def check_stage(stage):
+        if cancel_event.is_set():
+            raise AnalysisCancelled()
+        if stage != last_stage[0]:
+            last_stage[0] = stage
+            result_queue.put(('progress', stage))
+
+    try:
+        # 同じ内容のCSVはディスク上の学習結果キャッシュから読み込み、末尾に行が追加されただけなら差分更新する
+        result = fit_cache.analyze_csv(file_path, dataset_cache, streaming_threshold_bytes, solver, check_stage, low_memory,
+                                       sparse_center)
+
+        if cancel_event.is_set():
+            result.release()
+            raise AnalysisCancelled()
+        result_queue.put(('done', result))
+    except AnalysisCancelled:
+        result_queue.put(('cancelled', None))
+    except Exception as e:
+        traceback.print_exc()
+        result_queue.put(('error', e))
+
+
+def _stability_worker(result, file_path, method, n_replicates, cancel_event, result_queue):
+    # --- 再標本化と再学習はプロセスプールで行い、完了した回数をキューで知らせる ---
+    def check_progress(done, total):
+        if cancel_event.is_set():
+            raise AnalysisCancelled()
+        result_queue.put(('replicates', (done, total)))
+
+    try:
+        stability = run_stability(result, file_path, method, n_replicates, check_progress=check_progress)
+        if cancel_event.is_set():
+            raise AnalysisCancelled()
+        result_queue.put(('stability_done', stability))
+    except AnalysisCancelled:
+        result_queue.put(('cancelled', None))
+    except Exception as e:
+        traceback.print_exc()
+        result_queue.put(('error', e))
+
 
 # --- GUIアプリケーションのクラス定義 ---
 class PcaApp:
@@ -29,15 +105,30 @@ class PcaApp:
         self.root.configure(bg=self.BG_COLOR)
 
         self.file_path = None
-        self.pca = None
-        self.pc_df = None
-        self.df = None
-        self.numerical_df_columns = None
+        self.result = None
+        # 分析結果の元のCSV (安定性評価で数値列を読み直すため。選択中のファイルとは限らない)
+        self.result_file_path = None
+        self.running_file_path = None
+        self.stability = None
+        self.scatter_hover = None
+        self.scatter_artists = {}
+        self.density_scatter = None
+        self.loadings_ax = None
+        # タブのウィジェット名 → 遅延描画用の情報 (描画関数・描画済みのFigure/Canvas/Toolbar)
+        self.plot_tabs = {}
         self.style_widgets = {}
+        self.dataset_cache = DatasetCache()
+        self.fit_cache = FitCache()
+        self.streaming_threshold_bytes = STREAMING_THRESHOLD_BYTES
+
+        # --- バックグラウンド分析の状態 ---
+        self.worker_thread = None
+        self.cancel_event = None
+        self.result_queue = None
 
         # ★★★ 変更点: 色の選択肢に 'white' と 'black' を追加 ★★★
-        self.matplotlib_colors = ['blue', 'red', 'green', 'purple', 'orange', 'cyan', 'magenta', 'brown', 'gold', 'teal', 'white', 'black']
-        self.matplotlib_markers = ['o', 's', '^', 'D', 'v', '*', 'p', 'X', '+', 'H']
+        self.matplotlib_colors = CATEGORY_COLORS
+        self.matplotlib_markers = CATEGORY_MARKERS
 
         self.set_dark_title_bar()
         self.setup_ui()
@@ -63,12 +154,62 @@ class PcaApp:
         )
         self.path_label.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
-        run_button = tk.Button(top_control_frame, text="2. 分析実行", command=self.run_analysis, **button_style)
-        run_button.pack(side=tk.LEFT, padx=5)
+        tk.Label(top_control_frame, text="ソルバー:", bg=self.BG_COLOR, fg=self.TEXT_COLOR, font=("Arial", 9)).pack(side=tk.LEFT, padx=(5, 0))
+        self.solver_var = tk.StringVar(value='auto')
+        solver_menu = tk.OptionMenu(top_control_frame, self.solver_var, *PCA_SOLVERS)
+        solver_menu.config(width=14, bg=self.BUTTON_COLOR, fg=self.TEXT_COLOR, activebackground=self.BUTTON_ACTIVE_COLOR, relief=tk.RAISED)
+        solver_menu["menu"].config(bg=self.BUTTON_COLOR, fg=self.TEXT_COLOR)
+        solver_menu.pack(side=tk.LEFT, padx=5)
+
+        # 省メモリモード: 数値列をfloat32の1つの行列に読み込み、標準化をその場で行う
+        self.low_memory_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            top_control_frame, text="省メモリモード", variable=self.low_memory_var,
+            bg=self.BG_COLOR, fg=self.TEXT_COLOR, selectcolor=self.BUTTON_COLOR,
+            activebackground=self.BG_COLOR, activeforeground=self.TEXT_COLOR, font=("Arial", 9)
+        ).pack(side=tk.LEFT, padx=5)
+
+        # 疎行列入力 (.npz・縦持ちCSV) で平均を引くかどうか。外すと中心化せずに TruncatedSVD で学習する
+        self.sparse_center_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(
+            top_control_frame, text="疎行列を中心化", variable=self.sparse_center_var,
+            bg=self.BG_COLOR, fg=self.TEXT_COLOR, selectcolor=self.BUTTON_COLOR,
+            activebackground=self.BG_COLOR, activeforeground=self.TEXT_COLOR, font=("Arial", 9)
+        ).pack(side=tk.LEFT, padx=5)
+
+        self.run_button = tk.Button(top_control_frame, text="2. 分析実行", command=self.run_analysis, **button_style)
+        self.run_button.pack(side=tk.LEFT, padx=5)
         
         self.export_button = tk.Button(top_control_frame, text="3. 結果をエクスポート", command=self.export_results, **button_style, state=tk.DISABLED)
         self.export_button.pack(side=tk.LEFT, padx=5)
 
+        # 安定性評価: ブートストラップ (信頼区間) または置換検定 (偶然で得られる寄与率) を指定回数だけ再学習する
+        self.stability_method_var = tk.StringVar(value=STABILITY_METHODS[0])
+        stability_menu = tk.OptionMenu(top_control_frame, self.stability_method_var, *STABILITY_METHODS)
+        stability_menu.config(width=11, bg=self.BUTTON_COLOR, fg=self.TEXT_COLOR, activebackground=self.BUTTON_ACTIVE_COLOR, relief=tk.RAISED)
+        stability_menu["menu"].config(bg=self.BUTTON_COLOR, fg=self.TEXT_COLOR)
+        stability_menu.pack(side=tk.LEFT, padx=(15, 5))
+        self.replicates_var = tk.StringVar(value=str(DEFAULT_REPLICATES))
+        tk.Spinbox(top_control_frame, from_=10, to=10000, increment=50, width=6, textvariable=self.replicates_var,
+                   bg=self.LABEL_BG_COLOR, fg=self.TEXT_COLOR, buttonbackground=self.BUTTON_COLOR,
+                   insertbackground=self.TEXT_COLOR).pack(side=tk.LEFT)
+        tk.Label(top_control_frame, text="回", bg=self.BG_COLOR, fg=self.TEXT_COLOR, font=("Arial", 9)).pack(side=tk.LEFT)
+        self.stability_button = tk.Button(top_control_frame, text="4. 安定性を評価", command=self.run_stability_analysis, **button_style, state=tk.DISABLED)
+        self.stability_button.pack(side=tk.LEFT, padx=5)
+
+        # --- 1.5 進捗表示フレーム ---
+        progress_frame = tk.Frame(self.root, bg=self.BG_COLOR)
+        progress_frame.pack(side=tk.TOP, fill=tk.X, padx=10, pady=(0, 10))
+
+        self.progress_bar = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, mode='determinate', maximum=100, length=300)
+        self.progress_bar.pack(side=tk.LEFT, padx=5)
+
+        self.status_label = tk.Label(progress_frame, text="待機中", bg=self.BG_COLOR, fg=self.TEXT_COLOR, font=("Arial", 9), anchor='w')
+        self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+
+        self.cancel_button = tk.Button(progress_frame, text="キャンセル", command=self.cancel_analysis, **button_style, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=5)
+
 
         # --- 2. メインコンテンツフレーム ---
         main_content_frame = tk.Frame(self.root, bg=self.BG_COLOR)
@@ -97,6 +238,8 @@ class PcaApp:
         self.notebook = ttk.Notebook(main_content_frame)
         self.notebook.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
+        self.notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
+        
         initial_tab = tk.Frame(self.notebook, bg=self.FRAME_COLOR)
         self.notebook.add(initial_tab, text="Plots")
         tk.Label(initial_tab, text="分析を実行するとここにグラフが表示されます。", bg=self.FRAME_COLOR, fg=self.TEXT_COLOR, font=("Arial", 12)).pack(expand=True)
@@ -111,6 +254,7 @@ class PcaApp:
                   background=[("selected", self.FRAME_COLOR), ("!selected", self.BUTTON_COLOR)],
                   foreground=[("selected", self.TEXT_COLOR), ("!selected", self.TEXT_COLOR)])
         style.configure("TFrame", background=self.FRAME_COLOR)
+        style.configure("Horizontal.TProgressbar", background="steelblue", troughcolor=self.LABEL_BG_COLOR, borderwidth=0)
 
     def set_dark_title_bar(self):
         if sys.platform == "win32":
@@ -125,7 +269,7 @@ class PcaApp:
                 print(f"タイトルバーのダークモード設定に失敗しました: {e}")
 
     def select_file(self):
-        path = filedialog.askopenfilename(title="CSVファイルを選択してください", filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        path = filedialog.askopenfilename(title="CSVファイルを選択してください", filetypes=[("CSV files", "*.csv"), ("Sparse matrix", "*.npz"), ("All files", "*.*")])
         if path:
             self.file_path = path.strip(' "')
             display_name = self.file_path.split('/')[-1]
@@ -137,199 +281,351 @@ class PcaApp:
         if not self.file_path:
             messagebox.showwarning("警告", "先にCSVファイルを選択してください。")
             return
-        
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            return
+
         self.export_button.config(state=tk.DISABLED)
+        self.stability_button.config(state=tk.DISABLED)
+        self.run_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+
+        # --- 読み込み・標準化・PCAはワーカースレッドで行い、結果はroot.afterでポーリングする ---
+        self.running_file_path = self.file_path
+        self.cancel_event = threading.Event()
+        self.result_queue = queue.Queue()
+        self.worker_thread = threading.Thread(
+            target=_analysis_worker, args=(self.file_path, self.dataset_cache, self.fit_cache, self.streaming_threshold_bytes,
+                  self.solver_var.get(), self.low_memory_var.get(), self.sparse_center_var.get(), self.cancel_event, self.result_queue),
+            daemon=True
+        )
+        self.worker_thread.start()
+        self.root.after(WORKER_POLL_INTERVAL_MS, self._poll_worker, self.result_queue)
 
+    def run_stability_analysis(self):
+        if self.result is None:
+            messagebox.showwarning("警告", "先に分析を実行してください。")
+            return
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            return
         try:
-            self.df = pd.read_csv(self.file_path)
-            if self.df.empty:
-                messagebox.showerror("データエラー", "CSVファイルが空です。")
-                return
+            n_replicates = int(self.replicates_var.get())
+        except ValueError:
+            n_replicates = 0
+        if n_replicates < 10:
+            messagebox.showwarning("警告", "再学習の回数は10以上の整数で指定してください。")
+            return
 
-            numerical_df = self.df.select_dtypes(include=['number'])
-            if numerical_df.empty or len(numerical_df.columns) < 2:
-                messagebox.showerror("データエラー", "分析には少なくとも2つ以上の数値列が必要です。")
-                return
+        self.export_button.config(state=tk.DISABLED)
+        self.stability_button.config(state=tk.DISABLED)
+        self.run_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self._set_replicate_progress(0, n_replicates)
+
+        self.cancel_event = threading.Event()
+        self.result_queue = queue.Queue()
+        self.worker_thread = threading.Thread(
+            target=_stability_worker, args=(self.result, self.result_file_path, self.stability_method_var.get(), n_replicates,
+                  self.cancel_event, self.result_queue), daemon=True
+        )
+        self.worker_thread.start()
+        self.root.after(WORKER_POLL_INTERVAL_MS, self._poll_worker, self.result_queue)
 
-            self.numerical_df_columns = numerical_df.columns
-            scaler = StandardScaler()
-            scaled_data = scaler.fit_transform(numerical_df)
-            
-            self.pca = PCA(n_components=min(10, len(self.numerical_df_columns)))
-            principal_components = self.pca.fit_transform(scaled_data)
-            
-            pc_cols = [f'PC{i+1}' for i in range(self.pca.n_components_)]
-            self.pc_df = pd.DataFrame(data=principal_components, columns=pc_cols, index=numerical_df.index)
-            if 'category' in self.df.columns:
-                self.pc_df['category'] = self.df.loc[numerical_df.index, 'category'].astype(str)
-
-            for i in reversed(range(self.notebook.index('end'))):
-                self.notebook.forget(i)
-
-            current_styles = self._get_current_styles()
-            self._draw_plot_on_tab("PCA Scatter Plot", self._create_scatter_plot, style_map=current_styles)
-            self._draw_plot_on_tab("Explained Variance", self._create_explained_variance_plot)
-            self._draw_plot_on_tab("Loadings Plot", self._create_loadings_plot)
-            
-            messagebox.showinfo("成功", "分析と描画が完了しました。")
+    def cancel_analysis(self):
+        if self.cancel_event is None or self.cancel_event.is_set():
+            return
+        # 実行中の処理 (CSVの読み込みやPCAの学習) が終わり次第ワーカーは停止する。結果は破棄し、前回の結果はそのまま残す
+        # スレッドが終了するまでは次の実行を受け付けない (CPUやメモリを使い続けているため)
+        self.cancel_event.set()
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_label.config(text="キャンセル中…")
+
+    def _poll_worker(self, result_queue):
+        # 再実行後の古いキューは読み捨てる
+        if result_queue is not self.result_queue:
+            return
+        if self.cancel_event.is_set():
+            self._poll_cancelled_worker(result_queue)
+            return
+        try:
+            while True:
+                kind, payload = result_queue.get_nowait()
+                if kind == 'progress':
+                    self._set_progress(payload)
+                elif kind == 'replicates':
+                    self._set_replicate_progress(*payload)
+                elif kind == 'stability_done':
+                    self._on_stability_done(payload)
+                    return
+                elif kind == 'done':
+                    self._on_analysis_done(payload)
+                    return
+                elif kind == 'error':
+                    self._on_analysis_error(payload)
+                    return
+                elif kind == 'cancelled':
+                    self._finish_job("キャンセルしました")
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(WORKER_POLL_INTERVAL_MS, self._poll_worker, result_queue)
+
+    def _poll_cancelled_worker(self, result_queue):
+        # キャンセル後に届いた進捗や結果は捨て、ワーカースレッドの終了を待ってから操作を戻す
+        try:
+            while True:
+                kind, payload = result_queue.get_nowait()
+                if kind == 'done':
+                    payload.release()
+        except queue.Empty:
+            pass
+        if self.worker_thread.is_alive():
+            self.root.after(WORKER_POLL_INTERVAL_MS, self._poll_worker, result_queue)
+        else:
+            self._finish_job("キャンセルしました")
+
+    def _set_progress(self, stage):
+        text, value = ANALYSIS_STAGES[stage]
+        self.status_label.config(text=text)
+        self.progress_bar['value'] = value
+        self.root.update_idletasks()
+
+    def _set_replicate_progress(self, done, total):
+        self.status_label.config(text=f"再標本化してPCAを再学習中... ({done}/{total})")
+        self.progress_bar['value'] = 100 * done / total
+        self.root.update_idletasks()
+
+    def _finish_job(self, status_text):
+        self.result_queue = None
+        self.cancel_event = None
+        self.worker_thread = None
+        self.progress_bar['value'] = 0
+        self.status_label.config(text=status_text)
+        self.run_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        if self.result is not None:
             self.export_button.config(state=tk.NORMAL)
+            # 疎行列入力やストリーミングモードの結果は安定性評価に対応していない
+            if stability_unsupported_reason(self.result) is None:
+                self.stability_button.config(state=tk.NORMAL)
+
+    def _on_analysis_done(self, result):
+        self.cancel_button.config(state=tk.DISABLED)
+        self._set_progress('rendering')
+        try:
+            # ストリーミングモードのスコアファイルは結果を置き換えた時点で不要になる
+            if self.result is not None:
+                self.result.release()
+            self.result = result
+            self.result_file_path = self.running_file_path
+            self.stability = None
+
+            # グラフは各タブが最初に選択されたときに描画する (最初のタブはここで選択されて描画される)
+            self._release_plot_tabs()
+            self._add_plot_tab("PCA Scatter Plot", lambda: self._create_scatter_plot(style_map=self._get_current_styles()))
+            self._add_plot_tab("Explained Variance", self._create_explained_variance_plot)
+            self._add_plot_tab("Loadings Plot", self._create_loadings_plot, self._create_loadings_controls)
+            self.notebook.select(0)
+            self._on_tab_changed()
+
+            fit_info = result.fit_info
+            if fit_info.get('cache') == 'hit':
+                status = f"完了 (キャッシュから読み込み, ソルバー: {fit_info['solver']})"
+            elif fit_info.get('cache') == 'appended':
+                status = f"完了 (キャッシュを追加の{fit_info['appended_rows']}行で更新, 更新時間: {fit_info['seconds']:.2f}秒)"
+            else:
+                status = f"完了 (ソルバー: {fit_info['solver']}, 学習時間: {fit_info['seconds']:.2f}秒)"
+            peak_rss = _format_peak_rss(fit_info.get('peak_rss', {}))
+            if peak_rss:
+                status += f"  ピークメモリ: {peak_rss}"
+            self._finish_job(status)
+            self.progress_bar['value'] = 100
+            messagebox.showinfo("成功", "分析と描画が完了しました。")
 
         except Exception as e:
+            self._finish_job("エラー")
             messagebox.showerror("エラー", f"分析中に予期せぬエラーが発生しました:\n{e}")
-            import traceback
             traceback.print_exc()
 
+    def _on_stability_done(self, stability):
+        self.stability = stability
+        self._refresh_stability_plots()
+        if stability.method == 'bootstrap':
+            status = f"安定性評価が完了しました (ブートストラップ {stability.n_replicates}回, 95%信頼区間を表示)"
+        else:
+            significant = stability.significant_components()
+            summary = f"p<0.05の成分: PC1〜PC{significant}" if significant else "p<0.05の成分なし"
+            status = f"安定性評価が完了しました (置換検定 {stability.n_replicates}回, {summary})"
+        self._finish_job(status)
+
+    def _on_analysis_error(self, error):
+        self._finish_job("エラー")
+        if isinstance(error, DataError):
+            messagebox.showerror("データエラー", str(error))
+        else:
+            messagebox.showerror("エラー", f"分析中に予期せぬエラーが発生しました:\n{error}")
+
     def export_results(self):
-        if self.pc_df is None or self.df is None:
+        result = self.result
+        if result is None:
             messagebox.showwarning("エクスポート不可", "先に分析を実行してください。")
             return
 
         try:
-            id_col_name = self.df.columns[0]
-            columns_to_join = [self.df[[id_col_name]]]
-            if 'category' in self.df.columns:
-                columns_to_join.append(self.df[['category']])
-
-            export_df = self.pc_df.join(columns_to_join)
-            
-            final_columns = [id_col_name]
-            if 'category' in self.df.columns:
-                final_columns.append('category')
-            final_columns.extend([col for col in self.pc_df.columns if col.startswith('PC')])
-            export_df = export_df.reindex(columns=final_columns)
-
             original_filename = self.file_path.split('/')[-1].rsplit('.', 1)[0]
             default_savename = f"{original_filename}_pca_scores.csv"
 
             filepath = filedialog.asksaveasfilename(
                 defaultextension=".csv",
-                filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+                filetypes=[("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("Feather files", "*.feather"),
+                           ("NumPy arrays", "*.npy")],
                 initialfile=default_savename,
-                title="主成分スコアをCSV形式で保存"
+                title="主成分スコアと学習済みモデルを保存"
             )
 
             if filepath:
-                export_df.to_csv(filepath, index=False)
-                messagebox.showinfo("成功", f"分析結果を以下のファイルに保存しました:\n{filepath}")
+                # スコアは選択した形式で、モデル (ローディング・寄与率・スケーラー) は <名前>_model フォルダに保存する
+                written = export_scores(result, filepath)
+                written.append(save_model(result, model_dir_for_path(filepath)))
+                messagebox.showinfo("成功", "分析結果を以下に保存しました:\n" + "\n".join(written))
 
         except Exception as e:
             messagebox.showerror("エクスポートエラー", f"ファイルのエクスポート中にエラーが発生しました:\n{e}")
 
-    def _draw_plot_on_tab(self, tab_title, plot_function, **kwargs):
+    def _add_plot_tab(self, tab_title, plot_function, controls_function=None):
+        # controls_function(frame) はグラフの上に表示する操作部品を作る (グラフと同じく初回選択時に作成)
         tab_frame = ttk.Frame(self.notebook)
         self.notebook.add(tab_frame, text=tab_title)
-        fig = plot_function(**kwargs)
+        self.plot_tabs[str(tab_frame)] = {'frame': tab_frame, 'plot_function': plot_function, 'controls_function': controls_function,
+                                          'figure': None, 'canvas': None, 'toolbar': None}
+
+    def _on_tab_changed(self, event=None):
+        tab = self.plot_tabs.get(self.notebook.select())
+        if tab is None or tab['figure'] is not None:
+            return
+        fig = tab['plot_function']()
         if not fig: return
-        canvas = FigureCanvasTkAgg(fig, master=tab_frame)
+        if tab['controls_function'] is not None:
+            tab['controls_function'](tab['frame'])
+        canvas = FigureCanvasTkAgg(fig, master=tab['frame'])
         canvas.draw()
-        toolbar = NavigationToolbar2Tk(canvas, tab_frame)
+        toolbar = NavigationToolbar2Tk(canvas, tab['frame'])
         toolbar.config(background=self.FRAME_COLOR)
         toolbar._message_label.config(background=self.FRAME_COLOR, foreground=self.TEXT_COLOR)
         for button in toolbar.winfo_children():
             button.config(background=self.BUTTON_COLOR)
         toolbar.update()
         canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-    
+        tab.update(figure=fig, canvas=canvas, toolbar=toolbar)
+
+    def _release_plot_tab(self, tab):
+        # pyplotを使っていないのでFigureはどこにも登録されていない。
+        # Tkウィジェットと参照を破棄すれば、FigureとCanvasはまとめて解放される
+        if tab['figure'] is None:
+            return
+        for widget in tab['frame'].winfo_children():
+            widget.destroy()
+        tab['figure'].clear()
+        tab.update(figure=None, canvas=None, toolbar=None)
+
+    def _release_plot_tabs(self):
+        for tab in self.plot_tabs.values():
+            self._release_plot_tab(tab)
+        self.plot_tabs = {}
+        self.scatter_hover = None
+        self.scatter_artists = {}
+        self.density_scatter = None
+        self.loadings_ax = None
+        for tab_id in self.notebook.tabs():
+            self.notebook.nametowidget(tab_id).destroy()
+
     def _create_scatter_plot(self, style_map=None):
-        plt.style.use('default')
-        matplotlib.rcParams.update({'font.family': 'serif', 'font.size': 12, 'axes.linewidth': 1.5})
-        fig, ax = plt.subplots(figsize=(10, 7), facecolor='white')
-        ax.set_facecolor('white')
+        result = self.result
+        fig, self.scatter_artists, self.density_scatter = create_scatter_figure(result, style_map)
+
+        # ホバー用に、ID・カテゴリを散布図の点の並びに合わせた配列として一度だけ用意する
+        id_column_name = result.id_column_name
+        self.scatter_hover = ScatterHover(
+            fig.axes[0], result.pc_df['PC1'].to_numpy(), result.pc_df['PC2'].to_numpy(),
+            row_index=result.pc_df.index.to_numpy(),
+            ids=result.df.loc[result.pc_df.index, id_column_name].to_numpy(), id_name=id_column_name,
+            categories=result.pc_df['category'].to_numpy() if result.has_category else None,
+            text_color=self.TEXT_COLOR,
+        )
+        return fig
 
-        has_category = 'category' in self.pc_df.columns
-        scatter_artists = []
-        
-        if has_category and style_map:
-            default_style = {'color': 'black', 'marker': 'x'}
-            for category_name, group_df in self.pc_df.groupby('category'):
-                style = style_map.get(str(category_name), default_style)
-                # ★★★ 変更点: 黒背景で見えなくなるのを防ぐため、黒(black)の点には白い縁取りを追加 ★★★
-                edge_color = 'white' if style['color'] == 'black' else 'k'
-                scatter = ax.scatter(group_df['PC1'], group_df['PC2'], c=style['color'], marker=style['marker'], label=category_name,
-                                     alpha=0.7, s=50, edgecolors=edge_color, linewidths=0.5)
-                scatter.set_gid(category_name)
-                scatter_artists.append(scatter)
-            legend = ax.legend(title='Category', frameon=True, facecolor='white', edgecolor='black', labelcolor='black')
-            if legend.get_title(): legend.get_title().set_color('black')
+    def _apply_styles_live(self):
+        # 再読み込み・再学習をせず、表示中の散布図アーティストだけを更新する
+        if self.result is None or not self.result.has_category:
+            return
+        # スタイル設定にないカテゴリ (別のファイルを選び直した場合など) は現在のスタイルのままにする
+        style_map = self._get_current_styles()
+        if self.density_scatter is not None:
+            ax = self.density_scatter.ax
+            current = self.density_scatter.styles
+            self.density_scatter.set_styles({name: style_map.get(str(name), current[name]) for name in current})
+        elif self.scatter_artists:
+            for category_name, scatter in self.scatter_artists.items():
+                if str(category_name) in style_map:
+                    apply_scatter_style(scatter, style_map[str(category_name)])
+            ax = next(iter(self.scatter_artists.values())).axes
         else:
-            scatter = ax.scatter(self.pc_df['PC1'], self.pc_df['PC2'], alpha=0.7, c='blue', edgecolors='k', linewidths=0.5)
-            scatter_artists.append(scatter)
+            return
+        draw_scatter_legend(ax)
+        ax.figure.canvas.draw_idle()
 
-        ax.set_title('Principal Component Analysis (2D Scatter Plot)', color='black', fontweight='bold')
-        ax.set_xlabel(f'Principal Component 1 ({self.pca.explained_variance_ratio_[0]:.2%})', color='black')
-        ax.set_ylabel(f'Principal Component 2 ({self.pca.explained_variance_ratio_[1]:.2%})', color='black')
-        
-        for spine in ax.spines.values(): spine.set_color('black')
-        ax.tick_params(axis='x', colors='black'); ax.tick_params(axis='y', colors='black')
-        ax.grid(True, color='#CCCCCC', linestyle='--', linewidth=0.5)
-        ax.axhline(0, color='grey', lw=0.8, ls='--'); ax.axvline(0, color='grey', lw=0.8, ls='--')
-
-        cursor = mplcursors.cursor(scatter_artists, hover=True)
-        id_column_name = self.df.columns[0]
-        @cursor.connect("add")
-        def on_add(sel):
-            point_index = sel.index
-            if has_category:
-                category_gid = sel.artist.get_gid()
-                original_index = self.pc_df[self.pc_df['category'] == category_gid].index[point_index]
-            else:
-                original_index = self.pc_df.index[point_index]
-            
-            data_id = self.df.loc[original_index, id_column_name]
-            text_lines = [f"{id_column_name}: {data_id}", f"Index: {original_index}"]
-            if has_category: text_lines.append(f"Category: {self.pc_df.loc[original_index, 'category']}")
-            
-            sel.annotation.set_text('\n'.join(text_lines))
-            sel.annotation.get_bbox_patch().set(facecolor='#4C566A', alpha=0.95, edgecolor="#E5E9F0")
-            sel.annotation.arrow_patch.set(arrowstyle="->", facecolor=self.TEXT_COLOR, alpha=0.7)
-            sel.annotation.set_color(self.TEXT_COLOR)
-        
-        fig.tight_layout(pad=2.0)
-        return fig
+    def _refresh_stability_plots(self):
+        # 寄与率のグラフは作り直し (未表示なら次に選択されたときに描画)、ローディングは表示中の設定のまま描き直す
+        for tab in self.plot_tabs.values():
+            if tab['plot_function'] == self._create_explained_variance_plot:
+                self._release_plot_tab(tab)
+        self._update_loadings_plot()
+        self._on_tab_changed()
 
     def _create_explained_variance_plot(self):
-        plt.style.use('default')
-        fig, ax1 = plt.subplots(figsize=(10, 7), facecolor='white')
-        ax1.set_facecolor('white')
-        variance_ratio = self.pca.explained_variance_ratio_
-        cum_variance_ratio = np.cumsum(variance_ratio)
-        pc_labels = [f'PC{i+1}' for i in range(len(variance_ratio))]
-        ax1.bar(pc_labels, variance_ratio, alpha=0.7, color='steelblue', label='Explained Variance Ratio')
-        ax1.set_xlabel('Principal Components', color='black', fontweight='bold')
-        ax1.set_ylabel('Explained Variance Ratio', color='black')
-        ax1.tick_params(axis='y', labelcolor='black'); ax1.tick_params(axis='x', colors='black', rotation=45)
-        ax2 = ax1.twinx()
-        ax2.plot(pc_labels, cum_variance_ratio, color='firebrick', marker='o', linestyle='-', label='Cumulative Explained Variance')
-        ax2.set_ylabel('Cumulative Explained Variance', color='black')
-        ax2.tick_params(axis='y', labelcolor='black'); ax2.set_ylim(0, 1.05)
-        ax1.set_title('Explained Variance by Principal Components', color='black', fontweight='bold')
-        fig.legend(loc="upper right", bbox_to_anchor=(0.9, 0.9), bbox_transform=ax1.transAxes)
-        for spine in ax1.spines.values(): spine.set_color('black')
-        for spine in ax2.spines.values(): spine.set_color('black')
-        fig.tight_layout()
-        return fig
-        
+        return create_explained_variance_figure(self.result, self.stability)
+
     def _create_loadings_plot(self):
-        plt.style.use('default')
-        fig, ax = plt.subplots(figsize=(8, 8), facecolor='white')
-        ax.set_facecolor('white')
-        loadings = self.pca.components_.T[:, :2]
-        for i, var_name in enumerate(self.numerical_df_columns):
-            ax.arrow(0, 0, loadings[i, 0], loadings[i, 1], head_width=0.03, head_length=0.03, fc='darkred', ec='darkred', alpha=0.7)
-            ax.text(loadings[i, 0] * 1.15, loadings[i, 1] * 1.15, var_name, color='black', ha='center', va='center',
-                    bbox=dict(boxstyle="round,pad=0.3", fc="white", ec="none", alpha=0.7))
-        ax.set_xlabel('Principal Component 1 Loadings', color='black'); ax.set_ylabel('Principal Component 2 Loadings', color='black')
-        ax.set_title('Loadings Plot', color='black', fontweight='bold')
-        ax.set_xlim(-1.1, 1.1); ax.set_ylim(-1.1, 1.1)
-        ax.axhline(0, color='grey', ls='--', lw=0.8); ax.axvline(0, color='grey', ls='--', lw=0.8)
-        ax.grid(True, color='#CCCCCC', ls='--', lw=0.5)
-        for spine in ax.spines.values(): spine.set_color('black')
-        ax.tick_params(axis='x', colors='black'); ax.tick_params(axis='y', colors='black')
-        circle = plt.Circle((0, 0), 1, color='gray', fill=False, ls='--', alpha=0.7)
-        ax.add_artist(circle)
-        fig.tight_layout()
+        fig = create_loadings_figure(self.result, stability=self.stability)
+        self.loadings_ax = fig.axes[0]
         return fig
 
+    def _create_loadings_controls(self, frame):
+        # 表示する主成分の組と、ラベルを付ける変数の数 (上位k) を選ぶ。変更時は再分析せず軸だけ描き直す
+        pc_columns = [f'PC{i+1}' for i in range(self.result.pca.n_components_)]
+        controls = tk.Frame(frame, bg=self.FRAME_COLOR)
+        controls.pack(side=tk.TOP, fill=tk.X)
+        label_style = {"bg": self.FRAME_COLOR, "fg": self.TEXT_COLOR, "font": ("Arial", 9)}
+
+        self.loadings_pc_x_var = tk.StringVar(value=pc_columns[0])
+        self.loadings_pc_y_var = tk.StringVar(value=pc_columns[1])
+        for text, var in (("横軸:", self.loadings_pc_x_var), ("縦軸:", self.loadings_pc_y_var)):
+            tk.Label(controls, text=text, **label_style).pack(side=tk.LEFT, padx=(5, 0), pady=3)
+            menu = tk.OptionMenu(controls, var, *pc_columns)
+            menu.config(width=5, bg=self.BUTTON_COLOR, fg=self.TEXT_COLOR, activebackground=self.BUTTON_ACTIVE_COLOR, relief=tk.RAISED)
+            menu["menu"].config(bg=self.BUTTON_COLOR, fg=self.TEXT_COLOR)
+            menu.pack(side=tk.LEFT, padx=5, pady=3)
+
+        self.loadings_top_k_var = tk.StringVar(value=str(LOADINGS_TOP_K))
+        tk.Label(controls, text="ラベル表示 (上位k変数):", **label_style).pack(side=tk.LEFT, padx=(5, 0), pady=3)
+        tk.Spinbox(controls, from_=0, to=len(self.result.numerical_df_columns), width=6, textvariable=self.loadings_top_k_var,
+                   bg=self.LABEL_BG_COLOR, fg=self.TEXT_COLOR, buttonbackground=self.BUTTON_COLOR,
+                   insertbackground=self.TEXT_COLOR).pack(side=tk.LEFT, padx=5, pady=3)
+
+        for var in (self.loadings_pc_x_var, self.loadings_pc_y_var, self.loadings_top_k_var):
+            var.trace_add("write", lambda *args: self._update_loadings_plot())
+
+    def _update_loadings_plot(self):
+        if self.loadings_ax is None:
+            return
+        try:
+            top_k = int(self.loadings_top_k_var.get())
+        except ValueError:
+            return  # 入力途中の値は無視する
+        pc_x = int(self.loadings_pc_x_var.get()[2:]) - 1
+        pc_y = int(self.loadings_pc_y_var.get()[2:]) - 1
+        draw_loadings(self.loadings_ax, self.result, pc_x, pc_y, top_k, self.stability)
+        self.loadings_ax.figure.canvas.draw_idle()
+
     # ★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★
     # ★★★ 変更点: OptionMenuの項目色を変更するロジックを追加 ★★★
     # ★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★
@@ -338,11 +634,15 @@ class PcaApp:
         self.style_widgets = {}
         if not self.file_path: return
         try:
-            df = pd.read_csv(self.file_path)
-            if 'category' not in df.columns:
+            # .npz ではカテゴリを <名前>_labels.csv から読む
+            category_path = category_source_path(self.file_path)
+            categories = None
+            if category_path is not None:
+                large_file = os.path.getsize(category_path) >= self.streaming_threshold_bytes
+                categories = self.dataset_cache.unique_values(category_path, 'category', chunksize=STREAMING_CHUNK_ROWS if large_file else None)
+            if categories is None:
                 tk.Label(self.style_inner_frame, text="'category' 列が見つかりません。", bg=self.FRAME_COLOR, fg=self.TEXT_COLOR).pack(pady=20)
                 return
-            categories = df['category'].unique()
             header_frame = tk.Frame(self.style_inner_frame, bg=self.FRAME_COLOR)
             header_frame.grid(row=0, column=0, sticky="ew", pady=(0, 5))
             self.style_inner_frame.grid_columnconfigure(0, weight=1)
@@ -392,6 +692,10 @@ class PcaApp:
                 color_var.trace_add("write", 
                                   lambda name, index, mode, var=color_var, label=category_label: 
                                       label.config(fg=var.get()))
+
+                # 色・マーカーの変更は表示中の散布図にすぐ反映する
+                color_var.trace_add("write", lambda *args: self._apply_styles_live())
+                marker_var.trace_add("write", lambda *args: self._apply_styles_live())
                 
                 self.style_widgets[cat_str] = {'color_var': color_var, 'marker_var': marker_var}
 
@@ -411,3 +715,5 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = PcaApp(root)
     root.mainloop()
+    if app.result is not None:
+        app.result.release()
@@ -0,0 +1,133 @@
+"""複数のCSVファイルに対してPCAを一括実行するコマンドラインツール (GUI・ディスプレイ不要)。
+
+使用例:
+    python pca_batch.py data/ --output-dir results --workers 4 --png
+    python pca_batch.py "exports/*.csv" --solver randomized
+    python pca_batch.py counts.npz --sparse-scaling scale
+"""
+import argparse
+import glob
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pca_core import PCA_SOLVERS, STREAMING_THRESHOLD_BYTES, DataError, analyze_csv
+from pca_export import EXPORT_FORMATS, export_scores, model_dir_for_path, save_model
+
+# .npz と一緒に置くラベル・列名のファイル (ディレクトリ指定では分析対象にしない)
+SPARSE_SIDECAR_SUFFIXES = ('_labels.csv', '_features.csv')
+
+
+def _is_sparse_sidecar(path):
+    for suffix in SPARSE_SIDECAR_SUFFIXES:
+        if path.endswith(suffix) and os.path.exists(path[:-len(suffix)] + '.npz'):
+            return True
+    return False
+
+
+def collect_csv_files(inputs):
+    # ディレクトリは直下の *.csv と *.npz を、それ以外はglobパターン (またはファイルパス) として展開する
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(p for p in glob.glob(os.path.join(item, '*.csv')) if not _is_sparse_sidecar(p))
+            paths.extend(glob.glob(os.path.join(item, '*.npz')))
+        else:
+            paths.extend(glob.glob(item))
+    return sorted(set(os.path.abspath(p) for p in paths))
+
+
+def _limit_worker_threads(threads_per_worker):
+    # 各プロセスのBLASスレッド数を抑え、ワーカー数 × BLASスレッド数がコア数を超えないようにする
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(threads_per_worker)
+
+
+def process_file(path, output_dir, solver='auto', png=False, streaming_threshold_bytes=STREAMING_THRESHOLD_BYTES,
+                 export_format='csv', save_model_bundle=False, low_memory=False, sparse_center=True):
+    # 1ファイル分の 読み込み → 標準化 → PCA → エクスポート。GUIと同じ analyze_csv を使うのでスコアは同一になる
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    result = analyze_csv(path, streaming_threshold_bytes=streaming_threshold_bytes, solver=solver, low_memory=low_memory,
+                         sparse_center=sparse_center)
+    try:
+        scores_path = os.path.join(output_dir, f"{base_name}_pca_scores.{export_format}")
+        outputs = export_scores(result, scores_path)
+        if save_model_bundle:
+            outputs.append(save_model(result, model_dir_for_path(scores_path)))
+
+        if png:
+            from pca_plots import (create_explained_variance_figure, create_loadings_figure,
+                                   create_scatter_figure, default_style_map)
+            style_map = default_style_map(result.pc_df['category'].unique()) if result.has_category else {}
+            figures = {
+                'scatter': create_scatter_figure(result, style_map)[0],
+                'explained_variance': create_explained_variance_figure(result),
+                'loadings': create_loadings_figure(result),
+            }
+            for name, fig in figures.items():
+                png_path = os.path.join(output_dir, f"{base_name}_{name}.png")
+                fig.savefig(png_path)
+                fig.clear()
+                outputs.append(png_path)
+
+        return {'path': path, 'outputs': outputs, 'fit_info': result.fit_info}
+    finally:
+        result.release()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CSVファイルごとに主成分分析を行い、主成分スコア (とグラフ) を書き出します。")
+    parser.add_argument('inputs', nargs='+', help="CSV・.npzファイル、ディレクトリ、またはglobパターン")
+    parser.add_argument('-o', '--output-dir', default='pca_results', help="出力先ディレクトリ (既定: pca_results)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="並列に処理するプロセス数 (既定: CPUコア数)")
+    parser.add_argument('--solver', choices=PCA_SOLVERS, default='auto', help="PCAソルバー (既定: auto)")
+    parser.add_argument('--format', choices=sorted(set(EXPORT_FORMATS.values())), default='csv', help="主成分スコアの保存形式 (既定: csv)")
+    parser.add_argument('--save-model', action='store_true', help="ローディング・寄与率・スケーラーを <名前>_model フォルダに保存する")
+    parser.add_argument('--low-memory', action='store_true', help="省メモリモード (float32で読み込み、標準化をその場で行う) で処理する")
+    parser.add_argument('--sparse-scaling', choices=['center', 'scale'], default='center',
+                        help="疎行列入力の標準化 (center: 平均を引いて標準偏差で割る / scale: 標準偏差で割るだけ。既定: center)")
+    parser.add_argument('--png', action='store_true', help="散布図・寄与率・ローディングのPNGも出力する")
+    parser.add_argument('--streaming-threshold-mb', type=float, default=STREAMING_THRESHOLD_BYTES / (1024 * 1024),
+                        help="このサイズ (MB) 以上のCSVはストリーミングモードで処理する")
+    args = parser.parse_args(argv)
+
+    paths = collect_csv_files(args.inputs)
+    if not paths:
+        print("対象のCSVファイルが見つかりません。", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = max(1, min(args.workers, len(paths)))
+    threshold = int(args.streaming_threshold_mb * 1024 * 1024)
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_limit_worker_threads,
+                             initargs=(max(1, (os.cpu_count() or 1) // workers),)) as executor:
+        futures = {executor.submit(process_file, path, args.output_dir, args.solver, args.png, threshold,
+                                   args.format, args.save_model, args.low_memory, args.sparse_scaling == 'center'): path
+                   for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                info = future.result()
+            except DataError as e:
+                failures += 1
+                print(f"[データエラー] {path}: {e}", file=sys.stderr)
+                continue
+            except Exception:
+                failures += 1
+                print(f"[失敗] {path}", file=sys.stderr)
+                traceback.print_exc()
+                continue
+            fit_info = info['fit_info']
+            peak_mb = max(fit_info.get('peak_rss', {}).values(), default=0) / 1024 ** 2
+            print(f"[完了] {path} (ソルバー: {fit_info['solver']}, 学習時間: {fit_info['seconds']:.2f}秒, ピークメモリ: {peak_mb:.0f}MB)")
+            for output in info['outputs']:
+                print(f"    -> {output}")
+
+    print(f"{len(paths) - failures}/{len(paths)} ファイルを処理しました。")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""PCA Visualizer の処理段階ごとのベンチマーク (GUI・ディスプレイ不要、Aggバックエンドで描画)。
+
+行数n・列数p・カテゴリ数の組み合わせごとに合成データのCSVを作り、
+CSV読み込み → select_dtypes → 標準化 → PCA → 3種類のグラフ作成 → ホバー検索 → エクスポート
+の所要時間とピークメモリを計測して、JSONのレポートに書き出す。
+--baseline で以前のレポートを指定すると、遅くなった (またはメモリが増えた) 段階を回帰として表示する。
+
+使用例:
+    python pca_benchmark.py --grid quick --output bench.json
+    python pca_benchmark.py --n 100000 1000000 --p 10 100 --categories 0 5 --baseline bench.json
+    python pca_benchmark.py --current new.json --baseline bench.json   (計測せずにレポート同士を比較)
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+import sklearn
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from pca_core import PCA_SOLVERS, STREAMING_THRESHOLD_BYTES, DatasetCache, StageMemoryTracker, analyze_csv
+from pca_export import EXPORT_FORMATS, export_scores
+from pca_plots import (ScatterHover, create_explained_variance_figure, create_loadings_figure, create_scatter_figure,
+                       default_style_map)
+
+# --- 計測する組み合わせ (n, p, カテゴリ数)。full は数GBのCSVを作るので時間とディスクに注意 ---
+BENCHMARK_GRIDS = {
+    'quick': {'n': [1_000, 100_000], 'p': [4, 50], 'categories': [0, 5]},
+    'wide': {'n': [1_000, 10_000], 'p': [500, 5_000], 'categories': [3]},
+    'full': {'n': [1_000, 100_000, 1_000_000, 10_000_000], 'p': [4, 50, 500, 5_000], 'categories': [0, 5, 50]},
+}
+# n×p がこれを超える組み合わせは、明示的に --max-cells を増やさない限り飛ばす
+DEFAULT_MAX_CELLS = 200_000_000
+DATA_RANK = 5
+HOVER_LOOKUPS = 1_000
+REPORT_FORMAT_VERSION = 1
+# 比較時の既定の許容幅: 相対的な増加率と、これ以下の差は無視する絶対値 (秒・バイト)
+DEFAULT_TIME_TOLERANCE = 0.2
+DEFAULT_MIN_SECONDS = 0.05
+DEFAULT_MEMORY_TOLERANCE = 0.2
+DEFAULT_MIN_MEMORY_BYTES = 20 * 1024 * 1024
+
+
+def case_name(n, p, categories):
+    return f"n{n}_p{p}_c{categories}"
+
+
+def make_dataset(path, n, p, categories, seed=0, chunk_rows=100_000):
+    # 低ランク構造 + ノイズの数値列と、任意でカテゴリ列を持つCSVを作る (同じ引数なら同じ内容になる)
+    rng = np.random.default_rng(seed)
+    rank = min(DATA_RANK, p)
+    loadings = rng.normal(size=(rank, p))
+    columns = [f'x{j}' for j in range(p)]
+    category_names = np.array([f'cat_{k}' for k in range(categories)])
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for start in range(0, n, chunk_rows):
+            rows = min(chunk_rows, n - start)
+            data = rng.normal(size=(rows, rank)) @ loadings + 0.5 * rng.normal(size=(rows, p))
+            chunk = pd.DataFrame(data, columns=columns)
+            chunk.insert(0, 'ID', [f'S{i}' for i in range(start, start + rows)])
+            if categories:
+                chunk['category'] = category_names[rng.integers(categories, size=rows)]
+            chunk.to_csv(f, index=False, header=(start == 0), float_format='%.6g')
+
+
+def _dataset_path(data_dir, n, p, categories, seed):
+    return os.path.join(data_dir, f"bench_{case_name(n, p, categories)}_s{seed}.csv")
+
+
+class _StageTimer:
+    """段階ごとの所要時間とピークメモリを記録する。"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.memory = StageMemoryTracker()
+
+    def run(self, stage, func, *args, **kwargs):
+        self.memory.enter(stage)
+        start = time.perf_counter()
+        value = func(*args, **kwargs)
+        self.seconds[stage] = time.perf_counter() - start
+        self.memory.finish()
+        return value
+
+
+def _render(fig):
+    # GUIでキャンバスに表示するのと同じく、一度描画するところまでを計測する
+    FigureCanvasAgg(fig).draw()
+    return fig
+
+
+def run_case(path, solver='auto', export_formats=('.csv',), work_dir=None, hover_lookups=HOVER_LOOKUPS, seed=0,
+             streaming_threshold_bytes=STREAMING_THRESHOLD_BYTES):
+    timer = _StageTimer()
+    dataset_cache = DatasetCache(max_entries=1)
+    streaming = os.path.getsize(path) >= streaming_threshold_bytes
+
+    # ストリーミングモードではCSV全体を読み込まない (読み込み時間は標準化の1パス目に含まれる)
+    if not streaming:
+        df = timer.run('parse', dataset_cache.load, path)
+        timer.run('select_dtypes', df.select_dtypes, include=['number'])
+        del df
+
+    # 標準化とPCAはGUIと同じ analyze_csv を通し、各段階の開始時刻から所要時間を求める
+    # (読み込み済みのDataFrameはキャッシュから取り出されるので、'reading' は計測に含めない)
+    stage_starts = []
+
+    def check_stage(stage):
+        if not stage_starts or stage_starts[-1][0] != stage:
+            stage_starts.append((stage, time.perf_counter()))
+
+    result = analyze_csv(path, dataset_cache, streaming_threshold_bytes, solver, check_stage)
+    end = time.perf_counter()
+    boundaries = stage_starts + [(None, end)]
+    analysis_seconds = {stage: next_start - stage_start
+                        for (stage, stage_start), (_, next_start) in zip(boundaries, boundaries[1:])}
+    timer.seconds['scale'] = analysis_seconds.get('scaling', 0.0)
+    timer.seconds['fit'] = analysis_seconds.get('fitting', 0.0) + analysis_seconds.get('projecting', 0.0)
+    analysis_peaks = result.fit_info['peak_rss']
+    peak_rss = {'scale': analysis_peaks.get('scaling'),
+                'fit': max(analysis_peaks.get('fitting', 0), analysis_peaks.get('projecting', 0)) or None}
+    del dataset_cache
+
+    try:
+        style_map = default_style_map(result.pc_df['category'].unique()) if result.has_category else {}
+        scatter_fig = timer.run('scatter_plot', lambda: _render(create_scatter_figure(result, style_map)[0]))
+        ax = scatter_fig.axes[0]
+        x = result.pc_df['PC1'].to_numpy()
+        y = result.pc_df['PC2'].to_numpy()
+        hover = timer.run('hover_index', ScatterHover, ax, x, y, result.pc_df.index.to_numpy(),
+                          result.df[result.id_column_name].to_numpy(), result.id_column_name,
+                          result.pc_df['category'].to_numpy() if result.has_category else None)
+        # 実際のデータ点の近く (許容ピクセル内に収まる程度) にマウスを置いたときの検索時間
+        rng = np.random.default_rng(seed)
+        targets = rng.integers(len(x), size=hover_lookups)
+        jitter = rng.normal(scale=1e-3, size=(hover_lookups, 2)) * hover.scale
+        start = time.perf_counter()
+        hits = sum(hover.nearest(x[i] + dx, y[i] + dy) is not None for i, (dx, dy) in zip(targets, jitter))
+        timer.seconds['hover_lookup'] = (time.perf_counter() - start) / hover_lookups
+        scatter_fig.clear()
+        del hover, scatter_fig
+
+        timer.run('explained_variance_plot', lambda: _render(create_explained_variance_figure(result))).clear()
+        timer.run('loadings_plot', lambda: _render(create_loadings_figure(result))).clear()
+
+        export_dir = tempfile.mkdtemp(prefix='pca_bench_export_', dir=work_dir)
+        for ext in export_formats:
+            export_path = os.path.join(export_dir, f'scores{ext}')
+            written = timer.run(f'export_{EXPORT_FORMATS[ext]}', export_scores, result, export_path)
+            for written_path in written:
+                os.remove(written_path)
+        os.rmdir(export_dir)
+    finally:
+        fit_info = {key: value for key, value in result.fit_info.items() if key != 'peak_rss'}
+        result.release()
+        gc.collect()
+
+    peak_rss.update(timer.memory.peaks)
+    return {
+        'mode': 'streaming' if streaming else 'in_memory',
+        'stages': timer.seconds,
+        'peak_rss': peak_rss,
+        'fit_info': fit_info,
+        'hover_hits': hits,
+    }
+
+
+def compare_reports(baseline, current, time_tolerance=DEFAULT_TIME_TOLERANCE, min_seconds=DEFAULT_MIN_SECONDS,
+                    memory_tolerance=DEFAULT_MEMORY_TOLERANCE, min_memory_bytes=DEFAULT_MIN_MEMORY_BYTES):
+    # 両方のレポートにある組み合わせ・段階について、許容幅を超えて増えたものを回帰として返す
+    baseline_cases = {case['name']: case for case in baseline['cases']}
+    regressions = []
+    for case in current['cases']:
+        base = baseline_cases.get(case['name'])
+        if base is None:
+            continue
+        checks = [('seconds', 'stages', time_tolerance, min_seconds), ('peak_rss', 'peak_rss', memory_tolerance, min_memory_bytes)]
+        for metric, key, tolerance, min_delta in checks:
+            for stage, value in case[key].items():
+                old = base[key].get(stage)
+                if old is None or value is None:
+                    continue
+                # ホバー検索は1回あたりの時間なので、絶対値の閾値を回数分に換算して比較する
+                scale = HOVER_LOOKUPS if stage == 'hover_lookup' else 1
+                if value > old * (1 + tolerance) and (value - old) * scale > min_delta:
+                    regressions.append({'case': case['name'], 'stage': stage, 'metric': metric, 'baseline': old, 'current': value,
+                                        'ratio': value / old if old else float('inf')})
+    return regressions
+
+
+def _format_value(metric, value):
+    if metric == 'peak_rss':
+        return f"{value / 1024 ** 2:.0f}MB"
+    return f"{value * 1000:.3f}ms" if value < 0.01 else f"{value:.3f}s"
+
+
+def _print_case(name, case):
+    stages = ", ".join(f"{stage} {_format_value('seconds', seconds)}" for stage, seconds in case['stages'].items())
+    peak = max(case['peak_rss'].values(), default=0)
+    print(f"[{name}] {stages}  (ピークメモリ {_format_value('peak_rss', peak)}, ソルバー {case['fit_info'].get('solver')})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成データでPCA Visualizerの各処理段階の所要時間とピークメモリを計測します。")
+    parser.add_argument('--grid', choices=sorted(BENCHMARK_GRIDS), default='quick', help="計測する組み合わせのプリセット (既定: quick)")
+    parser.add_argument('--n', type=int, nargs='+', help="行数のリスト (指定するとプリセットの値を置き換える)")
+    parser.add_argument('--p', type=int, nargs='+', help="数値列数のリスト")
+    parser.add_argument('--categories', type=int, nargs='+', help="カテゴリ数のリスト (0でcategory列なし)")
+    parser.add_argument('--max-cells', type=int, default=DEFAULT_MAX_CELLS, help="n×p がこれを超える組み合わせは飛ばす")
+    parser.add_argument('--solver', choices=PCA_SOLVERS, default='auto', help="PCAソルバー (既定: auto)")
+    parser.add_argument('--export-formats', nargs='+', choices=sorted(EXPORT_FORMATS), default=['.csv'],
+                        help="計測するエクスポート形式 (既定: .csv)")
+    parser.add_argument('--streaming-threshold-mb', type=float, default=STREAMING_THRESHOLD_BYTES / (1024 * 1024),
+                        help="このサイズ (MB) 以上のCSVはストリーミングモードで計測する")
+    parser.add_argument('--data-dir', help="合成CSVの保存先。同じ組み合わせのCSVがあれば再利用する (既定: 一時ディレクトリ)")
+    parser.add_argument('--seed', type=int, default=0, help="合成データの乱数シード")
+    parser.add_argument('-o', '--output', default='pca_benchmark.json', help="JSONレポートの出力先 (既定: pca_benchmark.json)")
+    parser.add_argument('--baseline', help="比較対象のJSONレポート。回帰があれば終了コード1を返す")
+    parser.add_argument('--current', help="計測せず、このJSONレポートを --baseline と比較する")
+    parser.add_argument('--time-tolerance', type=float, default=DEFAULT_TIME_TOLERANCE, help="所要時間の許容増加率 (既定: 0.2)")
+    parser.add_argument('--memory-tolerance', type=float, default=DEFAULT_MEMORY_TOLERANCE, help="ピークメモリの許容増加率 (既定: 0.2)")
+    args = parser.parse_args(argv)
+
+    if args.current:
+        if not args.baseline:
+            parser.error("--current には --baseline の指定が必要です。")
+        with open(args.current, encoding='utf-8') as f:
+            report = json.load(f)
+    else:
+        grid = BENCHMARK_GRIDS[args.grid]
+        ns, ps, category_counts = args.n or grid['n'], args.p or grid['p'], args.categories or grid['categories']
+        data_dir = args.data_dir or tempfile.mkdtemp(prefix='pca_bench_data_')
+        os.makedirs(data_dir, exist_ok=True)
+        report = {
+            'format_version': REPORT_FORMAT_VERSION,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                'numpy': np.__version__, 'pandas': pd.__version__, 'scikit-learn': sklearn.__version__,
+                'matplotlib': matplotlib.__version__,
+            },
+            'settings': {'solver': args.solver, 'export_formats': args.export_formats, 'seed': args.seed,
+                         'streaming_threshold_mb': args.streaming_threshold_mb},
+            'cases': [],
+        }
+        for n, p, categories in itertools.product(ns, ps, category_counts):
+            name = case_name(n, p, categories)
+            if n * p > args.max_cells:
+                print(f"[スキップ] {name}: n×p が --max-cells ({args.max_cells}) を超えています")
+                continue
+            path = _dataset_path(data_dir, n, p, categories, args.seed)
+            if not os.path.exists(path):
+                make_dataset(path, n, p, categories, args.seed)
+            case = run_case(path, args.solver, args.export_formats, seed=args.seed,
+                            streaming_threshold_bytes=int(args.streaming_threshold_mb * 1024 * 1024))
+            case.update(name=name, n=n, p=p, categories=categories, file_bytes=os.path.getsize(path))
+            report['cases'].append(case)
+            _print_case(name, case)
+            if not args.data_dir:
+                os.remove(path)
+        if not args.data_dir:
+            os.rmdir(data_dir)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"レポートを書き出しました: {args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_reports(baseline, report, args.time_tolerance, memory_tolerance=args.memory_tolerance)
+    for item in regressions:
+        print(f"[回帰] {item['case']} {item['stage']} ({item['metric']}): "
+              f"{_format_value(item['metric'], item['baseline'])} -> {_format_value(item['metric'], item['current'])} (x{item['ratio']:.2f})")
+    print(f"ベースラインとの比較: 回帰 {len(regressions)} 件")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
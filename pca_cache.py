@@ -0,0 +1,365 @@
+"""PCA Visualizer の学習結果キャッシュ (ディスク上)。
+
+学習済みのスケーラー・PCA・主成分スコアを、CSVの内容のハッシュと列構成・分析設定をキーに保存する。
+同じ内容のCSVは再学習せずに読み込み、末尾に行が追加されただけのCSVは追加分だけで統計量とPCAを更新し、
+全行のスコアを更新後のモデルでチャンク単位に射影し直す。それ以外の変更は別の内容として扱い、古いエントリは容量上限を超えたときに古い順に削除する。
+"""
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.preprocessing import StandardScaler
+
+from pca_core import STREAMING_THRESHOLD_BYTES, PcaResult, _remove_scores_file, analyze_csv, pca_from_scaled_scatter
+from pca_sparse import is_sparse_input
+
+# --- キャッシュの保存先と容量上限 (環境変数で変更できる。上限0でキャッシュを無効化) ---
+FIT_CACHE_DIR = os.environ.get('PCA_FIT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.pca_visualizer', 'fit_cache'))
+FIT_CACHE_MAX_BYTES = int(float(os.environ.get('PCA_FIT_CACHE_MAX_MB', 2048)) * 1024 * 1024)
+FIT_CACHE_FORMAT_VERSION = 1
+HASH_BLOCK_BYTES = 1 << 20
+COPY_CHUNK_ROWS = 200_000
+
+
+class _AppendMismatch(Exception):
+    """追加された行が差分更新の前提 (同じ列構成・数値列) を満たさない。"""
+
+
+def _hash_prefixes(path, prefix_sizes, check_stage):
+    # ファイル全体のハッシュと、キャッシュ済みエントリのサイズまでの先頭部分のハッシュを1回の読み込みで求める
+    hasher = hashlib.blake2b(digest_size=20)
+    prefix_digests = {}
+    pending = sorted(size for size in set(prefix_sizes) if size > 0)
+    position = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_BYTES)
+            if not block:
+                break
+            while pending and pending[0] <= position + len(block):
+                cut = pending.pop(0) - position
+                hasher.update(block[:cut])
+                block = block[cut:]
+                position += cut
+                prefix_digests[position] = hasher.hexdigest()
+            hasher.update(block)
+            position += len(block)
+            check_stage('reading')
+    return hasher.hexdigest(), prefix_digests
+
+
+def _merge_scatter(scaler, scaled_scatter, new_rows):
+    # 既存の (行数, 平均, 中心化した散布行列) と追加行の統計量を、並列分散計算の式でまとめる
+    n_old = scaler.n_samples_seen_
+    mean_old = scaler.mean_
+    scatter_old = scaled_scatter * np.outer(scaler.scale_, scaler.scale_)
+
+    n_new = len(new_rows)
+    mean_new = new_rows.mean(axis=0)
+    centered = new_rows - mean_new
+    delta = mean_new - mean_old
+    n_total = n_old + n_new
+    mean = mean_old + delta * (n_new / n_total)
+    scatter = scatter_old + centered.T @ centered + np.outer(delta, delta) * (n_old * n_new / n_total)
+
+    var = np.diag(scatter) / n_total
+    scale = np.sqrt(var)
+    scale[scale == 0] = 1.0
+    merged = StandardScaler()
+    merged.mean_, merged.var_, merged.scale_ = mean, var, scale
+    merged.n_samples_seen_ = n_total
+    merged.n_features_in_ = len(mean)
+    return merged, scatter / np.outer(scale, scale)
+
+
+class FitCache:
+    """CSVの内容のハッシュと列構成をキーに、学習結果をディスクに保存するLRUキャッシュ。"""
+
+    def __init__(self, cache_dir=FIT_CACHE_DIR, max_bytes=FIT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def analyze_csv(self, file_path, dataset_cache=None, streaming_threshold_bytes=STREAMING_THRESHOLD_BYTES, solver='auto',
+                    check_stage=None, low_memory=False, sparse_center=True):
+        # pca_core.analyze_csv と同じ引数・戻り値。キャッシュにあれば読み込み、末尾への追記なら差分更新する
+        # 疎行列入力はキャッシュしない (エントリは表形式のCSVを前提にしている)
+        if self.max_bytes <= 0 or is_sparse_input(file_path):
+            return analyze_csv(file_path, dataset_cache, streaming_threshold_bytes, solver, check_stage, low_memory,
+                               sparse_center=sparse_center)
+        if check_stage is None:
+            check_stage = lambda stage: None
+
+        file_size = os.path.getsize(file_path)
+        mode = 'streaming' if file_size >= streaming_threshold_bytes else ('low_memory' if low_memory else 'in_memory')
+        settings = {'solver': solver, 'mode': mode}
+
+        check_stage('reading')
+        entries = [meta for meta in self._entries()
+                   if meta.get('format_version') == FIT_CACHE_FORMAT_VERSION and meta.get('sklearn_version') == sklearn.__version__
+                   and meta['settings'] == settings and meta['size'] <= file_size]
+        content_hash, prefix_digests = _hash_prefixes(file_path, [meta['size'] for meta in entries], check_stage)
+
+        for meta in entries:
+            if meta['size'] == file_size and meta['content_hash'] == content_hash:
+                result = self._load(meta, check_stage)
+                if result is not None:
+                    return result
+        for meta in entries:
+            appended_bytes = file_size - meta['size']
+            if (0 < appended_bytes and prefix_digests.get(meta['size']) == meta['content_hash'] and meta['has_scatter']
+                    and meta['ends_with_newline']):
+                try:
+                    result = self._append(meta, file_path, content_hash, file_size, check_stage)
+                except _AppendMismatch:
+                    continue
+                if result is not None:
+                    return result
+
+        result = analyze_csv(file_path, dataset_cache, streaming_threshold_bytes, solver, check_stage, low_memory, collect_stats=True)
+        self._store(result, file_path, content_hash, file_size, settings)
+        return result
+
+    # --- エントリの一覧・読み込み ---
+    def _entries(self):
+        # 形式やscikit-learnのバージョンが違うエントリも返す (容量管理の対象にするため)
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for name in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, name, 'meta.json')
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            meta['entry_dir'] = os.path.join(self.cache_dir, name)
+            entries.append(meta)
+        return entries
+
+    def _load_entry(self, meta):
+        entry_dir = meta['entry_dir']
+        with open(os.path.join(entry_dir, 'model.pkl'), 'rb') as f:
+            model = pickle.load(f)
+        labels = pd.read_pickle(os.path.join(entry_dir, 'labels.pkl'))
+        scores = np.load(os.path.join(entry_dir, 'scores.npy'), mmap_mode='r')
+        return model, labels, scores
+
+    def _load(self, meta, check_stage):
+        check_stage('reading')
+        try:
+            model, labels, scores = self._load_entry(meta)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            self._remove_entry(meta['entry_dir'])
+            return None
+        # 最終使用時刻をLRUの順序に使う
+        os.utime(os.path.join(meta['entry_dir'], 'meta.json'))
+        fit_info = dict(meta['fit_info'], cache='hit')
+        return self._make_result(meta, model, labels, scores, fit_info)
+
+    @staticmethod
+    def _make_result(meta, model, labels, scores, fit_info, scores_path=None):
+        pc_cols = [f'PC{i+1}' for i in range(scores.shape[1])]
+        pc_df = pd.DataFrame(scores, columns=pc_cols, copy=False)
+        if meta['has_category']:
+            pc_df['category'] = labels['category'].astype(str).to_numpy()
+        return PcaResult(labels, pd.Index(meta['numeric_columns']), model['scaler'], model['pca'], scores, pc_df, fit_info,
+                         scores_path=scores_path, scaled_scatter=model['scaled_scatter'])
+
+    # --- 末尾に行が追加されたファイルの差分更新 ---
+    def _append(self, meta, file_path, content_hash, file_size, check_stage):
+        old_rows = meta['n_rows']
+        with open(file_path, 'rb') as f:
+            header = f.readline()
+            f.seek(meta['size'])
+            tail = f.read()
+        try:
+            new_df = pd.read_csv(io.BytesIO(header + tail))
+        except (ValueError, pd.errors.ParserError):
+            raise _AppendMismatch()
+        numeric_cols = meta['numeric_columns']
+        if list(new_df.columns) != meta['columns'] or len(new_df) == 0:
+            raise _AppendMismatch()
+        if not all(pd.api.types.is_numeric_dtype(new_df[col]) for col in numeric_cols):
+            raise _AppendMismatch()
+        new_rows = new_df[numeric_cols].to_numpy(dtype=np.float64)
+        if not np.isfinite(new_rows).all():
+            raise _AppendMismatch()
+
+        try:
+            model, labels, old_scores = self._load_entry(meta)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            self._remove_entry(meta['entry_dir'])
+            return None
+
+        check_stage('scaling')
+        start = time.perf_counter()
+        scaler, scaled_scatter = _merge_scatter(model['scaler'], model['scaled_scatter'], new_rows)
+        check_stage('fitting')
+        # 全行を射影し直すので、成分の符号は更新前のモデルに合わせず pca_from_scaled_scatter の規則のままにする
+        # (最初から学習し直した場合と同じ向きになる)
+        pca = pca_from_scaled_scatter(scaled_scatter, scaler.n_samples_seen_, model['pca'].n_components_)
+
+        id_col = meta['id_column']
+        new_labels = new_df[[id_col] + (['category'] if meta['has_category'] else [])]
+        if meta['has_category'] and isinstance(labels['category'].dtype, pd.CategoricalDtype):
+            new_labels = new_labels.assign(category=new_labels['category'].astype(str))
+            labels = labels.assign(category=labels['category'].astype(str))
+        labels = pd.concat([labels, new_labels], ignore_index=True)
+        fit_info = {'solver': 'covariance_eigh', 'seconds': time.perf_counter() - start, 'appended_rows': len(new_df)}
+
+        # 既存行のスコアも更新後のモデルで射影し直す (全体を学習し直した場合と同じ座標系にそろえる)
+        # CSVの数値列を読むのはこの1回だけ。射影したスコアは一時ファイルに書き、エントリの保存にも使う
+        check_stage('projecting')
+        n_rows = old_rows + len(new_df)
+        dtype = old_scores.dtype
+        del old_scores
+        scores_path = self._project_rows(file_path, numeric_cols, scaler, pca, n_rows, dtype, check_stage)
+
+        settings = meta['settings']
+        model = {'scaler': scaler, 'pca': pca, 'scaled_scatter': scaled_scatter}
+        scores = np.load(scores_path, mmap_mode='r')
+        score_blocks = (scores[start:start + COPY_CHUNK_ROWS] for start in range(0, n_rows, COPY_CHUNK_ROWS))
+        entry_dir = self._write_entry(model, labels, score_blocks, n_rows, pca.n_components_, dtype, meta['columns'],
+                                      numeric_cols, id_col, meta['has_category'], file_path, content_hash, file_size, settings,
+                                      fit_info)
+        self._remove_entry(meta['entry_dir'])
+        if entry_dir is None:
+            # 保存できなかった場合は一時ファイルのスコアをそのまま使う (結果を手放すときに削除される)
+            return self._make_result(meta, model, labels, scores, dict(fit_info, cache='appended'), scores_path=scores_path)
+        del scores
+        _remove_scores_file(scores_path)
+        scores = np.load(os.path.join(entry_dir, 'scores.npy'), mmap_mode='r')
+        return self._make_result(meta, model, labels, scores, dict(fit_info, cache='appended'))
+
+    @staticmethod
+    def _project_rows(file_path, numeric_cols, scaler, pca, n_rows, dtype, check_stage):
+        # CSVの数値列をチャンク単位で読み、全行のスコアを一時ファイル (.npy) に書き込んでそのパスを返す
+        fd, scores_path = tempfile.mkstemp(prefix='pca_scores_', suffix='.npy')
+        os.close(fd)
+        scores = np.lib.format.open_memmap(scores_path, mode='w+', dtype=dtype, shape=(n_rows, pca.n_components_))
+        start = 0
+        try:
+            for chunk in pd.read_csv(file_path, usecols=numeric_cols, chunksize=COPY_CHUNK_ROWS):
+                check_stage('projecting')
+                stop = start + len(chunk)
+                if stop > n_rows:
+                    raise _AppendMismatch()
+                scores[start:stop] = pca.transform(scaler.transform(chunk[numeric_cols].to_numpy(dtype=np.float64)))
+                start = stop
+            if start != n_rows:
+                raise _AppendMismatch()
+            scores.flush()
+        except BaseException:
+            scores = None
+            _remove_scores_file(scores_path)
+            raise
+        del scores
+        return scores_path
+
+    # --- 保存と容量管理 ---
+    def _store(self, result, file_path, content_hash, file_size, settings):
+        model = {'scaler': result.scaler, 'pca': result.pca, 'scaled_scatter': result.scaled_scatter}
+        id_col = result.id_column_name
+        labels = result.df[[id_col] + (['category'] if result.has_category else [])]
+        columns = list(pd.read_csv(file_path, nrows=0).columns)
+        fit_info = {key: value for key, value in result.fit_info.items() if key != 'peak_rss'}
+        scores = result.scores
+        score_blocks = (scores[start:start + COPY_CHUNK_ROWS] for start in range(0, len(scores), COPY_CHUNK_ROWS))
+        self._write_entry(model, labels, score_blocks, scores.shape[0], scores.shape[1], scores.dtype, columns,
+                          [str(col) for col in result.numerical_df_columns], id_col, result.has_category, file_path,
+                          content_hash, file_size, settings, fit_info)
+
+    def _write_entry(self, model, labels, score_blocks, n_rows, n_components, dtype, columns, numeric_columns, id_col,
+                     has_category, file_path, content_hash, file_size, settings, fit_info):
+        # 一時ディレクトリに書き終えてから名前を変えるので、書き込み途中のエントリが読まれることはない
+        # score_blocks はスコアを先頭の行から順に返すブロックの列
+        if n_rows * n_components * np.dtype(dtype).itemsize > self.max_bytes:
+            return None
+        with open(file_path, 'rb') as f:
+            f.seek(file_size - 1)
+            ends_with_newline = f.read(1) in (b'\n', b'\r')
+        meta = {
+            'format_version': FIT_CACHE_FORMAT_VERSION,
+            'sklearn_version': sklearn.__version__,
+            'content_hash': content_hash,
+            'size': file_size,
+            'ends_with_newline': ends_with_newline,
+            'settings': settings,
+            'columns': [str(col) for col in columns],
+            'numeric_columns': numeric_columns,
+            'id_column': str(id_col),
+            'has_category': has_category,
+            'has_scatter': model['scaled_scatter'] is not None,
+            'n_rows': n_rows,
+            'fit_info': fit_info,
+            'source_path': os.path.abspath(file_path),
+        }
+        # 形式やscikit-learnのバージョンもキーに含め、読めなくなった古いエントリと同じ名前にならないようにする
+        key_source = [FIT_CACHE_FORMAT_VERSION, sklearn.__version__, content_hash, settings]
+        key = hashlib.blake2b(json.dumps(key_source, sort_keys=True).encode(), digest_size=16).hexdigest()
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        except OSError:
+            return None
+        try:
+            scores = np.lib.format.open_memmap(os.path.join(tmp_dir, 'scores.npy'), mode='w+', dtype=dtype,
+                                               shape=(n_rows, n_components))
+            start = 0
+            for block in score_blocks:
+                scores[start:start + len(block)] = block
+                start += len(block)
+            scores.flush()
+            del scores
+            with open(os.path.join(tmp_dir, 'model.pkl'), 'wb') as f:
+                pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+            labels.to_pickle(os.path.join(tmp_dir, 'labels.pkl'))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            # 同じキーのエントリが残っていれば置き換える (中身が空でないディレクトリには os.replace できない)
+            if os.path.exists(entry_dir):
+                self._remove_entry(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return None
+        except BaseException:
+            # キャンセルなどによる中断は呼び出し元に伝える
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self._evict(keep=entry_dir)
+        return entry_dir
+
+    def _evict(self, keep=None):
+        # 合計サイズが上限を超えている間、最終使用時刻の古いエントリから削除する
+        entries = []
+        for meta in self._entries():
+            entry_dir = meta['entry_dir']
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+                last_used = os.path.getmtime(os.path.join(entry_dir, 'meta.json'))
+            except OSError:
+                continue
+            entries.append((last_used, size, entry_dir))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_dir == keep:
+                continue
+            self._remove_entry(entry_dir)
+            total -= size
+
+    @staticmethod
+    def _remove_entry(entry_dir):
+        # Windowsではメモリマップで使用中のスコアは削除できないため、残ったファイルは次回以降の削除に任せる
+        shutil.rmtree(entry_dir, ignore_errors=True)
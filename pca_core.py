@@ -0,0 +1,550 @@
+"""PCA Visualizer の分析処理 (読み込み・標準化・PCA・エクスポート)。
+
+GUI (gui_pca_app.py) とコマンドライン (pca_batch.py) の両方から使うため、Tkやmatplotlibには依存しない。
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import sklearn
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+
+# --- pyarrowがあれば高速なCSVパーサーを使う ---
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+# --- ストリーミングモード: このサイズ以上のCSVは全体を読み込まず、チャンク単位で処理する ---
+# 環境変数 PCA_STREAMING_THRESHOLD_MB で閾値を変更できる
+STREAMING_THRESHOLD_BYTES = int(float(os.environ.get('PCA_STREAMING_THRESHOLD_MB', 1024)) * 1024 * 1024)
+STREAMING_CHUNK_ROWS = 100_000
+
+# --- 省メモリモード ---
+# 列の型を推定するために先頭から読む行数と、標準化の分散計算をまとめて行う行数
+LOW_MEMORY_SAMPLE_ROWS = 1000
+LOW_MEMORY_CHUNK_ROWS = 100_000
+
+
+class DataError(Exception):
+    """ユーザーに「データエラー」として表示する入力データの問題。"""
+
+
+class AnalysisCancelled(Exception):
+    """キャンセル要求によって分析処理が中断されたことを示す。"""
+
+
+def read_csv_fast(path, **kwargs):
+    if CSV_ENGINE == 'pyarrow':
+        try:
+            return pd.read_csv(path, engine='pyarrow', **kwargs)
+        except Exception:
+            # pyarrowで読めない形式は標準パーサーでやり直す (エラーメッセージも標準のものになる)
+            pass
+    return pd.read_csv(path, **kwargs)
+
+
+class DatasetCache:
+    """パス・サイズ・更新時刻をキーに、読み込み済みのDataFrameを保持するLRUキャッシュ。"""
+
+    def __init__(self, max_entries=2):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    def get(self, path):
+        key = self._key(path)
+        with self._lock:
+            df = self._entries.get(key)
+            if df is not None:
+                self._entries.move_to_end(key)
+            return df
+
+    def load(self, path):
+        df = self.get(path)
+        if df is not None:
+            return df
+        key = self._key(path)
+        df = read_csv_fast(path)
+        with self._lock:
+            # 同じファイルの古い版は不要なので取り除く
+            for old_key in [k for k in self._entries if k[0] == key[0]]:
+                del self._entries[old_key]
+            self._entries[key] = df
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return df
+
+    def unique_values(self, path, column, chunksize=None):
+        # キャッシュ済みならそこから、未読み込みなら対象列だけを読む。列がなければNone
+        df = self.get(path)
+        if df is not None:
+            return df[column].unique() if column in df.columns else None
+        header = pd.read_csv(path, nrows=0).columns
+        if column not in header:
+            return None
+        if chunksize is None:
+            return read_csv_fast(path, usecols=[column])[column].unique()
+        # 巨大なファイルは対象列もチャンク単位で走査する
+        seen = {}
+        for chunk in pd.read_csv(path, usecols=[column], chunksize=chunksize):
+            seen.update(dict.fromkeys(chunk[column].unique()))
+        return np.array(list(seen), dtype=object)
+
+
+# --- PCAソルバーの選択 ---
+# 'auto' は行数n・列数p・成分数kから以下の方針で選ぶ (n=2e5,p=100 / n=5e3,p=2e3 などでの計測に基づく):
+#   縦長 (p <= 1000 かつ n >= 2p)       : p×p共分散行列の固有値分解が最速
+#   大きな行列から少数の成分だけ求める : 乱択SVD
+#   それ以外 (小さな行列)               : 完全SVD
+PCA_SOLVERS = ('auto', 'full', 'randomized', 'covariance_eigh')
+COVARIANCE_EIGH_MAX_FEATURES = 1000
+RANDOMIZED_MIN_DIM = 500
+# 固有値が近接するデータでも完全SVDと一致させるため、反復回数とオーバーサンプリングを既定値より増やす
+RANDOMIZED_ITERATED_POWER = 20
+RANDOMIZED_OVERSAMPLES = 50
+# covariance_eigh は scikit-learn 1.5 で追加された
+_SKLEARN_HAS_COVARIANCE_EIGH = tuple(int(v) for v in sklearn.__version__.split('.')[:2]) >= (1, 5)
+
+
+def choose_pca_solver(n_samples, n_features, n_components):
+    if n_features <= COVARIANCE_EIGH_MAX_FEATURES and n_samples >= 2 * n_features:
+        return 'covariance_eigh' if _SKLEARN_HAS_COVARIANCE_EIGH else 'full'
+    if min(n_samples, n_features) >= RANDOMIZED_MIN_DIM and n_components < 0.8 * min(n_samples, n_features):
+        return 'randomized'
+    return 'full'
+
+
+def fit_pca(scaled_data, n_components, solver='auto', copy=True):
+    # PCAを学習してスコアを返す。実際に使ったソルバーと所要時間を fit_info に記録する
+    # copy=False の場合、学習中に scaled_data を上書きしてコピーを作らない (省メモリモード用)
+    n_samples, n_features = scaled_data.shape
+    if solver == 'auto':
+        solver = choose_pca_solver(n_samples, n_features, n_components)
+    elif solver not in PCA_SOLVERS:
+        raise ValueError(f"未知のPCAソルバーです: {solver}")
+    elif solver == 'covariance_eigh' and not _SKLEARN_HAS_COVARIANCE_EIGH:
+        solver = 'full'
+
+    start = time.perf_counter()
+    # 乱択SVDでも結果が毎回同じになるよう乱数シードを固定する
+    if solver == 'randomized':
+        pca = PCA(n_components=n_components, svd_solver=solver, random_state=0, copy=copy,
+                  iterated_power=RANDOMIZED_ITERATED_POWER, n_oversamples=RANDOMIZED_OVERSAMPLES)
+    else:
+        pca = PCA(n_components=n_components, svd_solver=solver, random_state=0, copy=copy)
+    principal_components = pca.fit_transform(scaled_data)
+    fit_info = {'solver': solver, 'seconds': time.perf_counter() - start}
+    return pca, principal_components, fit_info
+
+
+# --- 標準化後データの散布行列 (Σ z zᵀ)。行の追加に合わせてPCAを更新するための十分統計量 ---
+# p×p行列を保持するため、covariance_eigh と同じ列数までに限る
+SCATTER_STATS_MAX_FEATURES = COVARIANCE_EIGH_MAX_FEATURES
+
+
+def scaled_scatter_matrix(scaled_data, chunk_rows=LOW_MEMORY_CHUNK_ROWS):
+    # float32の行列でも精度を落とさないよう、チャンク単位でfloat64に変換して集計する
+    scatter = np.zeros((scaled_data.shape[1], scaled_data.shape[1]))
+    for start in range(0, len(scaled_data), chunk_rows):
+        block = np.asarray(scaled_data[start:start + chunk_rows], dtype=np.float64)
+        scatter += block.T @ block
+    return scatter
+
+
+def pca_from_scaled_scatter(scaled_scatter, n_samples, n_components):
+    # 散布行列の固有値分解から、fit済みのPCAと同じ属性を持つオブジェクトを組み立てる (covariance_eigh と同じ計算)
+    covariance = scaled_scatter / (n_samples - 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    eigenvalues = np.clip(eigenvalues[::-1], 0, None)
+    components = eigenvectors[:, ::-1].T
+    # 符号は各成分で絶対値最大の要素が正になるようにそろえる
+    signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+    signs[signs == 0] = 1
+    components *= signs[:, np.newaxis]
+
+    n_features = covariance.shape[0]
+    pca = PCA(n_components=n_components, svd_solver='covariance_eigh' if _SKLEARN_HAS_COVARIANCE_EIGH else 'full')
+    pca.n_features_in_ = n_features
+    pca.n_samples_ = n_samples
+    pca.n_components_ = n_components
+    pca.mean_ = np.zeros(n_features)
+    pca.components_ = components[:n_components]
+    pca.explained_variance_ = eigenvalues[:n_components]
+    total_variance = eigenvalues.sum()
+    pca.explained_variance_ratio_ = eigenvalues[:n_components] / total_variance if total_variance > 0 else np.zeros(n_components)
+    pca.singular_values_ = np.sqrt(eigenvalues[:n_components] * (n_samples - 1))
+    rest = eigenvalues[n_components:min(n_samples, n_features)]
+    pca.noise_variance_ = rest.mean() if len(rest) else 0.0
+    return pca
+
+
+class PcaResult:
+    """1回の分析で得られた学習済みのスケーラー・PCAとスコア。再描画やスタイル変更ではこれを再利用する。"""
+
+    def __init__(self, df, numerical_df_columns, scaler, pca, scores, pc_df, fit_info, scores_path=None, scaled_scatter=None):
+        self.df = df
+        self.numerical_df_columns = numerical_df_columns
+        self.scaler = scaler
+        self.pca = pca
+        # 主成分スコアの配列 (n行 × 成分数)。pc_df のPC列はこの配列を共有している
+        self.scores = scores
+        self.pc_df = pc_df
+        self.fit_info = fit_info
+        # ストリーミングモードでスコアを保持している一時ファイル (それ以外はNone)
+        self.scores_path = scores_path
+        # 標準化後データの散布行列 (collect_stats=True で列数が多すぎない場合のみ)。学習結果キャッシュの差分更新に使う
+        self.scaled_scatter = scaled_scatter
+
+    @property
+    def id_column_name(self):
+        return self.df.columns[0]
+
+    @property
+    def has_category(self):
+        return 'category' in self.pc_df.columns
+
+    @property
+    def pc_columns(self):
+        return [f'PC{i+1}' for i in range(self.scores.shape[1])]
+
+    def release(self):
+        # スコアのメモリマップを手放してから一時ファイルを削除する
+        self.pc_df = None
+        self.scores = None
+        _remove_scores_file(self.scores_path)
+        self.scores_path = None
+
+
+def _in_memory_pca(file_path, dataset_cache, check_stage, solver='auto', collect_stats=False):
+    check_stage('reading')
+    df = dataset_cache.load(file_path)
+    if df.empty:
+        raise DataError("CSVファイルが空です。")
+
+    numerical_df = df.select_dtypes(include=['number'])
+    if numerical_df.empty or len(numerical_df.columns) < 2:
+        raise DataError("分析には少なくとも2つ以上の数値列が必要です。")
+
+    check_stage('scaling')
+    scaler = StandardScaler()
+    scaled_data = scaler.fit_transform(numerical_df)
+    scaled_scatter = None
+    if collect_stats and scaled_data.shape[1] <= SCATTER_STATS_MAX_FEATURES:
+        scaled_scatter = scaled_data.T @ scaled_data
+
+    check_stage('fitting')
+    pca, principal_components, fit_info = fit_pca(scaled_data, min(10, len(numerical_df.columns)), solver)
+
+    pc_cols = [f'PC{i+1}' for i in range(pca.n_components_)]
+    pc_df = pd.DataFrame(data=principal_components, columns=pc_cols, index=numerical_df.index, copy=False)
+    if 'category' in df.columns:
+        pc_df['category'] = df.loc[numerical_df.index, 'category'].astype(str)
+
+    return PcaResult(df, numerical_df.columns, scaler, pca, principal_components, pc_df, fit_info, scaled_scatter=scaled_scatter)
+
+
+def _count_data_rows(file_path):
+    # 改行の数から、ヘッダーを除いた行数の上限を求める (引用符内の改行や空行があれば実際の行数はこれより少ない)
+    n_lines = 0
+    last = b'\n'
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            n_lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        n_lines += 1
+    return max(n_lines - 1, 0)
+
+
+def _low_memory_pca(file_path, check_stage, solver='auto', collect_stats=False):
+    # --- 省メモリモード: 必要な列だけをfloat32で読み、標準化はその場で行い、不要になった配列はすぐに解放する ---
+    check_stage('reading')
+    sample = pd.read_csv(file_path, nrows=LOW_MEMORY_SAMPLE_ROWS)
+    if sample.empty:
+        raise DataError("CSVファイルが空です。")
+    id_col_name = sample.columns[0]
+    numeric_cols = list(sample.select_dtypes(include=['number']).columns)
+    if len(numeric_cols) < 2:
+        raise DataError("分析には少なくとも2つ以上の数値列が必要です。")
+    has_category = 'category' in sample.columns
+
+    # ID・数値列・category 以外の列は読まない。IDは値を変えないよう元の型のまま読む
+    # pyarrowエンジンは読み込み中のバッファでピークメモリが大きくなるため、ここでは標準のパーサーを使う
+    usecols = list(dict.fromkeys([id_col_name] + numeric_cols + (['category'] if has_category else [])))
+    dtype = {col: np.float32 for col in numeric_cols if col != id_col_name}
+    if has_category:
+        dtype['category'] = 'category'
+    del sample
+
+    # 数値列はチャンクごとに、あらかじめ確保したfloat32の1つの行列へ直接書き込む
+    # (ファイル全体のDataFrameや列ごとの中間配列を作らない)。IDとカテゴリだけをDataFrameに残す
+    data = np.empty((_count_data_rows(file_path), len(numeric_cols)), dtype=np.float32)
+    id_parts, category_parts = [], []
+    n_rows = 0
+    for chunk in pd.read_csv(file_path, usecols=usecols, dtype=dtype, chunksize=LOW_MEMORY_CHUNK_ROWS):
+        stop = n_rows + len(chunk)
+        if stop > len(data):
+            # 改行の数より行が多い場合 (改行が \r だけのファイルなど) は行列を広げる
+            grown = np.empty((max(stop, 2 * len(data)), len(numeric_cols)), dtype=np.float32)
+            grown[:n_rows] = data[:n_rows]
+            data = grown
+        data[n_rows:stop] = chunk[numeric_cols].to_numpy(dtype=np.float32)
+        id_parts.append(chunk[id_col_name])
+        if has_category:
+            category_parts.append(chunk['category'].array)
+        n_rows = stop
+        check_stage('reading')
+    if n_rows == 0:
+        raise DataError("CSVファイルが空です。")
+    data = data[:n_rows]
+    df = pd.DataFrame({id_col_name: pd.concat(id_parts, ignore_index=True)})
+    del id_parts
+    if has_category:
+        df['category'] = union_categoricals(category_parts)
+        del category_parts
+
+    check_stage('scaling')
+    # 平均と分散はfloat64で集計し、行列はfloat32のままその場で標準化する (一時的なコピーはチャンク単位)
+    mean = data.mean(axis=0, dtype=np.float64)
+    data -= mean.astype(np.float32)
+    var = np.zeros(data.shape[1])
+    for start in range(0, n_rows, LOW_MEMORY_CHUNK_ROWS):
+        block = data[start:start + LOW_MEMORY_CHUNK_ROWS].astype(np.float64)
+        var += np.einsum('ij,ij->j', block, block)
+    del block
+    var /= n_rows
+    scale = np.sqrt(var)
+    scale[scale == 0] = 1.0
+    data /= scale.astype(np.float32)
+
+    # StandardScaler と同じ属性を持たせ、エクスポートや新しいデータの射影にそのまま使えるようにする
+    scaler = StandardScaler()
+    scaler.mean_, scaler.var_, scaler.scale_ = mean, var, scale
+    scaler.n_samples_seen_ = n_rows
+    scaler.n_features_in_ = len(numeric_cols)
+    scaled_scatter = None
+    if collect_stats and len(numeric_cols) <= SCATTER_STATS_MAX_FEATURES:
+        scaled_scatter = scaled_scatter_matrix(data)
+
+    check_stage('fitting')
+    pca, principal_components, fit_info = fit_pca(data, min(10, len(numeric_cols)), solver, copy=False)
+    del data
+
+    pc_cols = [f'PC{i+1}' for i in range(pca.n_components_)]
+    pc_df = pd.DataFrame(data=principal_components, columns=pc_cols, index=df.index, copy=False)
+    if has_category:
+        # カテゴリはCategoricalのまま、カテゴリ名だけを文字列にそろえる
+        categories = df['category']
+        pc_df['category'] = categories.cat.rename_categories([str(c) for c in categories.cat.categories])
+
+    return PcaResult(df, pd.Index(numeric_cols), scaler, pca, principal_components, pc_df, fit_info, scaled_scatter=scaled_scatter)
+
+
+def _streaming_pca(file_path, check_stage, chunk_rows=STREAMING_CHUNK_ROWS, collect_stats=False):
+    # --- メモリに載らないCSV用: チャンク単位で読み、数値データとスコアが使うメモリをチャンクサイズで抑える ---
+    # IDとカテゴリ (散布図のホバーや色分けに使う) だけは全行分をメモリに保持する
+    def read_chunks(**kwargs):
+        return pd.read_csv(file_path, chunksize=chunk_rows, **kwargs)
+
+    # 1パス目: 列構成の決定と StandardScaler.partial_fit
+    check_stage('scaling')
+    scaler = StandardScaler()
+    numeric_cols = None
+    n_rows = 0
+    for chunk in read_chunks():
+        if numeric_cols is None:
+            id_col_name = chunk.columns[0]
+            has_category = 'category' in chunk.columns
+            numeric_cols = chunk.select_dtypes(include=['number']).columns
+            if len(numeric_cols) < 2:
+                raise DataError("分析には少なくとも2つ以上の数値列が必要です。")
+        # 数値列は先頭のチャンクで決めるので、後のチャンクに数値でない値が混じっていないか確かめる
+        non_numeric = [col for col in numeric_cols if not pd.api.types.is_numeric_dtype(chunk[col])]
+        if non_numeric:
+            raise DataError(f"数値列 {', '.join(map(str, non_numeric))} の {n_rows + 2}〜{n_rows + len(chunk) + 1} 行目に"
+                            "数値でない値があります。")
+        scaler.partial_fit(chunk[numeric_cols].to_numpy(dtype=np.float64))
+        n_rows += len(chunk)
+        check_stage('scaling')
+    if numeric_cols is None or n_rows == 0:
+        raise DataError("CSVファイルが空です。")
+
+    # 2パス目: 標準化したチャンクで IncrementalPCA.partial_fit
+    # partial_fit は n_components 行以上を必要とするため、1チャンク分遅らせて端数を前のチャンクに結合する
+    check_stage('fitting')
+    fit_start = time.perf_counter()
+    n_components = min(10, len(numeric_cols))
+    pca = IncrementalPCA(n_components=n_components)
+    pending = None
+    scaled_scatter = None
+    if collect_stats and len(numeric_cols) <= SCATTER_STATS_MAX_FEATURES:
+        scaled_scatter = np.zeros((len(numeric_cols), len(numeric_cols)))
+    for chunk in read_chunks(usecols=list(numeric_cols)):
+        scaled = scaler.transform(chunk[numeric_cols].to_numpy(dtype=np.float64))
+        if scaled_scatter is not None:
+            scaled_scatter += scaled.T @ scaled
+        if pending is not None:
+            if len(scaled) < n_components:
+                scaled = np.vstack([pending, scaled])
+            else:
+                pca.partial_fit(pending)
+        pending = scaled
+        check_stage('fitting')
+    pca.partial_fit(pending)
+    del pending
+    fit_info = {'solver': 'incremental', 'seconds': time.perf_counter() - fit_start}
+
+    # 3パス目: 各チャンクを主成分スコアに射影し、ディスク上の.npyへ直接書き込む
+    check_stage('projecting')
+    fd, scores_path = tempfile.mkstemp(prefix='pca_scores_', suffix='.npy')
+    os.close(fd)
+    scores = np.lib.format.open_memmap(scores_path, mode='w+', dtype=np.float64, shape=(n_rows, pca.n_components_))
+    id_parts, category_parts = [], []
+    start = 0
+    try:
+        for chunk in read_chunks():
+            stop = start + len(chunk)
+            scores[start:stop] = pca.transform(scaler.transform(chunk[numeric_cols].to_numpy(dtype=np.float64)))
+            id_parts.append(chunk[id_col_name])
+            if has_category:
+                category_parts.append(chunk['category'].astype(str).astype('category').array)
+            start = stop
+            check_stage('projecting')
+        scores.flush()
+    except BaseException:
+        scores = None
+        _remove_scores_file(scores_path)
+        raise
+
+    # スコアはメモリマップのまま参照し、IDとカテゴリだけをメモリ上に保持する
+    # (IDは読み込んだ型のまま結合してPythonオブジェクトの配列にせず、カテゴリはCategoricalにして1行あたり数バイトに抑える)
+    df = pd.DataFrame({id_col_name: pd.concat(id_parts, ignore_index=True)})
+    del id_parts
+    if has_category:
+        df['category'] = union_categoricals(category_parts)
+        del category_parts
+
+    pc_cols = [f'PC{i+1}' for i in range(pca.n_components_)]
+    pc_df = pd.DataFrame(scores, columns=pc_cols, copy=False)
+    if has_category:
+        pc_df['category'] = df['category'].array
+
+    return PcaResult(df, numeric_cols, scaler, pca, scores, pc_df, fit_info, scores_path=scores_path, scaled_scatter=scaled_scatter)
+
+
+def _remove_scores_file(path):
+    if path is None:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        # Windowsではメモリマップが残っている間は削除できない。一時ディレクトリに残しておく
+        pass
+
+
+def _peak_rss_bytes():
+    # 現在のピーク常駐メモリ (RSS)。取得できない環境ではNone
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def _reset_peak_rss():
+    # Linuxではピーク値をリセットできるので、段階ごとのピークを測れる (それ以外の環境では累積のピークになる)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class StageMemoryTracker:
+    """分析の段階ごとのピーク常駐メモリ (バイト) を記録する。"""
+
+    def __init__(self):
+        self.peaks = {}
+        self._stage = None
+
+    def enter(self, stage):
+        if stage == self._stage:
+            return
+        self._close_stage()
+        self._stage = stage
+        _reset_peak_rss()
+
+    def finish(self):
+        self._close_stage()
+        self._stage = None
+
+    def _close_stage(self):
+        if self._stage is None:
+            return
+        peak = _peak_rss_bytes()
+        if peak is not None:
+            self.peaks[self._stage] = max(peak, self.peaks.get(self._stage, 0))
+
+
+def analyze_csv(file_path, dataset_cache=None, streaming_threshold_bytes=STREAMING_THRESHOLD_BYTES, solver='auto', check_stage=None,
+                low_memory=False, collect_stats=False, sparse_center=True):
+    # GUIとCLIで共通の入口。ファイルサイズに応じてメモリ上での処理とストリーミング処理を切り替える
+    # 疎行列入力 (.npz または row,column,value の縦持ちCSV) は pca_sparse で密にせずに処理する
+    # (sparse_center=False なら平均を引かずに TruncatedSVD で学習する)
+    # check_stage(stage) は各段階の開始時と処理の途中で呼ばれ、AnalysisCancelled を送出すれば中断できる
+    # 段階ごとのピークメモリは fit_info['peak_rss'] に記録する
+    # collect_stats=True の場合は標準化後データの散布行列も result.scaled_scatter に残す (学習結果キャッシュ用)
+    if check_stage is None:
+        check_stage = lambda stage: None
+    if dataset_cache is None:
+        # キャッシュを使わない呼び出し (CLIなど) では読み込んだDataFrameを保持しない
+        dataset_cache = DatasetCache(max_entries=0)
+
+    tracker = StageMemoryTracker()
+
+    def tracked_check_stage(stage):
+        tracker.enter(stage)
+        check_stage(stage)
+
+    # pca_sparse は pca_core を読み込むので、循環を避けてここで読み込む
+    from pca_sparse import analyze_sparse, is_sparse_input
+    if is_sparse_input(file_path):
+        result = analyze_sparse(file_path, tracked_check_stage, sparse_center)
+    elif os.path.getsize(file_path) >= streaming_threshold_bytes:
+        result = _streaming_pca(file_path, tracked_check_stage, collect_stats=collect_stats)
+    elif low_memory:
+        result = _low_memory_pca(file_path, tracked_check_stage, solver, collect_stats)
+    else:
+        result = _in_memory_pca(file_path, dataset_cache, tracked_check_stage, solver, collect_stats)
+    tracker.finish()
+    result.fit_info['peak_rss'] = tracker.peaks
+    return result
+
@@ -0,0 +1,171 @@
+"""PCA Visualizer のエクスポート処理 (主成分スコアと学習済みモデル)。
+
+スコアは結合済みのDataFrameを作らず、行をチャンクに分けて書き出す。
+学習済みモデル (ローディング・寄与率・スケーラーの平均/標準偏差・列名) は .npy + JSON のディレクトリとして保存し、
+load_model() で読み戻せば再学習なしで新しいデータを射影できる。
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# 拡張子 → 形式名
+EXPORT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather', '.npy': 'npy'}
+EXPORT_CHUNK_ROWS = 200_000
+MODEL_FORMAT_VERSION = 1
+
+
+def export_format_for_path(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError(f"対応していないエクスポート形式です: {ext or '(拡張子なし)'}  (対応形式: {', '.join(EXPORT_FORMATS)})")
+    return EXPORT_FORMATS[ext]
+
+
+def _iter_score_chunks(result, chunk_rows=EXPORT_CHUNK_ROWS):
+    # ID・カテゴリ・スコアを元のCSVの行順に、チャンク単位の小さなDataFrameとして返す
+    id_values = result.df[result.id_column_name].to_numpy()
+    category_values = result.df['category'].to_numpy() if 'category' in result.df.columns else None
+    pc_cols = result.pc_columns
+    for start in range(0, len(result.scores), chunk_rows):
+        stop = start + chunk_rows
+        chunk = {result.id_column_name: id_values[start:stop]}
+        if category_values is not None:
+            chunk['category'] = category_values[start:stop]
+        scores = np.asarray(result.scores[start:stop])
+        for i, col in enumerate(pc_cols):
+            chunk[col] = scores[:, i]
+        yield pd.DataFrame(chunk)
+
+
+def _require_pyarrow(format_name):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(f"{format_name}形式で保存するには pyarrow が必要です (pip install pyarrow)。") from None
+    return pyarrow
+
+
+def _write_csv(result, path):
+    header = True
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for chunk in _iter_score_chunks(result):
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+
+
+def _write_arrow(result, path, format_name):
+    pa = _require_pyarrow(format_name)
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    writer = None
+    try:
+        for chunk in _iter_score_chunks(result):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                # Feather (V2) はArrow IPCファイル形式なので、レコードバッチ単位で追記できる
+                if format_name == 'Parquet':
+                    writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+                else:
+                    writer = pyarrow.ipc.new_file(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_npy(result, path):
+    # スコアは float64 の (行数 × 成分数) 行列として書き、np.load(path, mmap_mode='r') で読めるようにする
+    # IDとカテゴリは数値行列に入らないので、同じ行順で <name>_labels.csv に書き出す
+    scores = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=result.scores.shape)
+    for start in range(0, len(result.scores), EXPORT_CHUNK_ROWS):
+        stop = start + EXPORT_CHUNK_ROWS
+        scores[start:stop] = result.scores[start:stop]
+    scores.flush()
+    del scores
+
+    labels_path = os.path.splitext(path)[0] + '_labels.csv'
+    header = True
+    with open(labels_path, 'w', newline='', encoding='utf-8') as f:
+        for chunk in _iter_score_chunks(result):
+            chunk.drop(columns=result.pc_columns).to_csv(f, index=False, header=header)
+            header = False
+    return [path, labels_path]
+
+
+def export_scores(result, path):
+    # 拡張子で形式を決めてスコアを書き出し、作成したファイルのリストを返す
+    format_name = export_format_for_path(path)
+    if format_name == 'csv':
+        _write_csv(result, path)
+    elif format_name == 'parquet':
+        _write_arrow(result, path, 'Parquet')
+    elif format_name == 'feather':
+        _write_arrow(result, path, 'Feather')
+    else:
+        return _write_npy(result, path)
+    return [path]
+
+
+def model_dir_for_path(path):
+    return os.path.splitext(path)[0] + '_model'
+
+
+def save_model(result, model_dir):
+    # ローディング・寄与率・スケーラーの平均/標準偏差・列名を、メモリマップで読める .npy と JSON で保存する
+    os.makedirs(model_dir, exist_ok=True)
+    pca = result.pca
+    arrays = {
+        'components': pca.components_,
+        'explained_variance': pca.explained_variance_,
+        'explained_variance_ratio': pca.explained_variance_ratio_,
+        'pca_mean': pca.mean_,
+        'scaler_mean': result.scaler.mean_,
+        'scaler_scale': result.scaler.scale_,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(model_dir, f'{name}.npy'), np.asarray(array, dtype=np.float64))
+    metadata = {
+        'format_version': MODEL_FORMAT_VERSION,
+        'columns': [str(col) for col in result.numerical_df_columns],
+        'n_components': int(pca.n_components_),
+        'fit_info': result.fit_info,
+    }
+    with open(os.path.join(model_dir, 'model.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    return model_dir
+
+
+class PcaModel:
+    """save_model() で保存したモデル。標準化とPCAの射影を再学習なしで行う。"""
+
+    def __init__(self, columns, components, explained_variance, explained_variance_ratio, pca_mean, scaler_mean, scaler_scale):
+        self.columns = columns
+        self.components_ = components
+        self.explained_variance_ = explained_variance
+        self.explained_variance_ratio_ = explained_variance_ratio
+        self.pca_mean_ = pca_mean
+        self.scaler_mean_ = scaler_mean
+        self.scaler_scale_ = scaler_scale
+
+    @property
+    def n_components_(self):
+        return self.components_.shape[0]
+
+    def transform(self, df):
+        # 学習時と同じ列を取り出し、同じ平均・標準偏差で標準化してから射影する
+        missing = [col for col in self.columns if col not in df.columns]
+        if missing:
+            raise ValueError(f"モデルの学習に使った列がありません: {', '.join(missing)}")
+        scaled = (df[self.columns].to_numpy(dtype=np.float64) - self.scaler_mean_) / self.scaler_scale_
+        return (scaled - self.pca_mean_) @ self.components_.T
+
+
+def load_model(model_dir, mmap_mode=None):
+    with open(os.path.join(model_dir, 'model.json'), encoding='utf-8') as f:
+        metadata = json.load(f)
+    arrays = {name: np.load(os.path.join(model_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+              for name in ('components', 'explained_variance', 'explained_variance_ratio', 'pca_mean', 'scaler_mean', 'scaler_scale')}
+    return PcaModel(metadata['columns'], **arrays)
@@ -0,0 +1,375 @@
+"""PCA Visualizer のグラフ描画 (散布図・寄与率・ローディング)。
+
+pyplotを使わず matplotlib.figure.Figure で描画するため、GUIのTkAggキャンバスにもCLIのPNG出力 (Agg) にもそのまま使える。
+"""
+import matplotlib
+import matplotlib.colors as mcolors
+import matplotlib.style
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.image import AxesImage
+from matplotlib.markers import MarkerStyle
+from matplotlib.patches import Circle
+from scipy.spatial import cKDTree
+
+# --- カテゴリごとの既定のスタイル (カテゴリの出現順に割り当てる) ---
+CATEGORY_COLORS = ['blue', 'red', 'green', 'purple', 'orange', 'cyan', 'magenta', 'brown', 'gold', 'teal', 'white', 'black']
+CATEGORY_MARKERS = ['o', 's', '^', 'D', 'v', '*', 'p', 'X', '+', 'H']
+DEFAULT_CATEGORY_STYLE = {'color': 'black', 'marker': 'x'}
+
+
+def default_style_map(categories):
+    return {str(category): {'color': CATEGORY_COLORS[i % len(CATEGORY_COLORS)], 'marker': CATEGORY_MARKERS[i % len(CATEGORY_MARKERS)]}
+            for i, category in enumerate(categories)}
+
+
+# --- 散布図の密度表示: 点数が多い場合は個々のマーカーではなくカテゴリ別の2次元ヒストグラム画像で描画する ---
+DENSITY_MODE_MIN_POINTS = 200_000
+DENSITY_MARKER_MAX_POINTS = 20_000
+DENSITY_PIXELS_PER_BIN = 2
+
+
+def _scatter_edge_color(color):
+    # 黒背景で見えなくなるのを防ぐため、黒(black)の点には白い縁取りを付ける
+    return 'white' if color == 'black' else 'k'
+
+
+def apply_scatter_style(scatter, style):
+    # 既存の散布図アーティストの色とマーカーをその場で差し替える (ax.scatter と同じ規則で縁取りを決める)
+    marker = MarkerStyle(style['marker'])
+    scatter.set_paths([marker.get_path().transformed(marker.get_transform())])
+    scatter.set_facecolor(style['color'])
+    if marker.is_filled():
+        scatter.set_edgecolor(_scatter_edge_color(style['color']))
+        scatter.set_linewidth(0.5)
+    else:
+        scatter.set_edgecolor('face')
+        scatter.set_linewidth(matplotlib.rcParams['lines.linewidth'])
+
+
+class _DensityImage(AxesImage):
+    # 描画の直前に表示範囲を確認し、変わっていれば再集計する
+    def __init__(self, ax, owner, **kwargs):
+        super().__init__(ax, **kwargs)
+        self._owner = owner
+
+    def draw(self, renderer):
+        self._owner.refresh(renderer)
+        super().draw(renderer)
+
+
+class DensityScatter:
+    """大量の点を、表示範囲内だけ再集計するカテゴリ別密度画像として描画する。
+
+    表示範囲内の点数が max_markers 以下になるまでズームすると、個々のマーカー表示に切り替わる。
+    groups は (カテゴリ名, x, y) のリスト、styles はカテゴリ名から {'color', 'marker'} への辞書。
+    """
+
+    def __init__(self, ax, groups, styles, max_markers=DENSITY_MARKER_MAX_POINTS):
+        self.ax = ax
+        self.groups = groups
+        self.styles = styles
+        self.max_markers = max_markers
+        self._last_view = None
+
+        # マーカー表示用のアーティストは先に作っておき、表示範囲に応じて点の座標だけを入れ替える
+        self.marker_artists = []
+        for name, _, _ in groups:
+            style = styles[name]
+            scatter = ax.scatter([], [], c=style['color'], marker=style['marker'], label=name,
+                                 alpha=0.7, s=50, edgecolors=_scatter_edge_color(style['color']), linewidths=0.5, zorder=2)
+            scatter.set_gid(name)
+            self.marker_artists.append(scatter)
+
+        all_x = np.concatenate([x for _, x, _ in groups])
+        all_y = np.concatenate([y for _, _, y in groups])
+        x_min, x_max = np.nanmin(all_x), np.nanmax(all_x)
+        y_min, y_max = np.nanmin(all_y), np.nanmax(all_y)
+        x_margin = (x_max - x_min) * 0.05 or 1.0
+        y_margin = (y_max - y_min) * 0.05 or 1.0
+        ax.set_xlim(x_min - x_margin, x_max + x_margin)
+        ax.set_ylim(y_min - y_margin, y_max + y_margin)
+
+        self.image = _DensityImage(ax, self, origin='lower', interpolation='nearest', zorder=1)
+        self.image.set_data(np.zeros((1, 1, 4)))
+        self.image.set_extent((x_min, x_max, y_min, y_max))
+        ax.add_image(self.image)
+
+    def set_styles(self, styles):
+        self.styles = styles
+        for (name, _, _), scatter in zip(self.groups, self.marker_artists):
+            apply_scatter_style(scatter, styles[name])
+        # 次回の描画で密度画像を新しい色で作り直す
+        self._last_view = None
+
+    def refresh(self, renderer):
+        (x0, y0), (x1, y1) = self.ax.viewLim.get_points()
+        bbox = self.ax.get_window_extent(renderer)
+        n_x = int(np.clip(bbox.width / DENSITY_PIXELS_PER_BIN, 16, 1000))
+        n_y = int(np.clip(bbox.height / DENSITY_PIXELS_PER_BIN, 16, 1000))
+        view = (x0, x1, y0, y1, n_x, n_y)
+        if view == self._last_view:
+            return
+        self._last_view = view
+
+        visible = []
+        for _, x, y in self.groups:
+            mask = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+            visible.append((x[mask], y[mask]))
+
+        if sum(len(vx) for vx, _ in visible) <= self.max_markers:
+            for scatter, (vx, vy) in zip(self.marker_artists, visible):
+                scatter.set_offsets(np.column_stack([vx, vy]))
+            self.image.set_visible(False)
+            return
+
+        for scatter in self.marker_artists:
+            scatter.set_offsets(np.empty((0, 2)))
+        self.image.set_data(self._composite(visible, (x0, x1, y0, y1), n_x, n_y))
+        self.image.set_extent((x0, x1, y0, y1))
+        self.image.set_visible(True)
+
+    def _composite(self, visible, extent, n_x, n_y):
+        # カテゴリごとの点数を対数スケールの不透明度に変換し、カテゴリ色で順に重ねる (乗算済みアルファで合成)
+        x0, x1, y0, y1 = extent
+        premultiplied = np.zeros((n_y, n_x, 3))
+        alpha_total = np.zeros((n_y, n_x))
+        for (name, _, _), (vx, vy) in zip(self.groups, visible):
+            if len(vx) == 0:
+                continue
+            ix = np.clip(((vx - x0) * (n_x / (x1 - x0))).astype(np.intp), 0, n_x - 1)
+            iy = np.clip(((vy - y0) * (n_y / (y1 - y0))).astype(np.intp), 0, n_y - 1)
+            counts = np.bincount(iy * n_x + ix, minlength=n_x * n_y).reshape(n_y, n_x)
+            alpha = np.where(counts > 0, 0.3 + 0.7 * np.log1p(counts) / np.log1p(counts.max()), 0.0)
+            rgb = np.array(mcolors.to_rgb(self.styles[name]['color']))
+            premultiplied = premultiplied * (1 - alpha)[..., None] + rgb * alpha[..., None]
+            alpha_total = alpha + alpha_total * (1 - alpha)
+
+        rgba = np.zeros((n_y, n_x, 4))
+        covered = alpha_total > 0
+        rgba[covered, :3] = premultiplied[covered] / alpha_total[covered, None]
+        rgba[..., 3] = alpha_total
+        return rgba
+
+
+# --- 散布図のホバー表示 ---
+HOVER_TOLERANCE_PX = 8
+
+
+class ScatterHover:
+    """KD木でマウス位置に最も近い点を探し、その点のID・カテゴリをツールチップで表示する。
+
+    x, y, row_index, ids, categories はすべて同じ並びの配列で、ホバー時の検索・参照は配列の添字だけで行う。
+    """
+
+    def __init__(self, ax, x, y, row_index, ids, id_name, categories=None, text_color='white', tolerance_px=HOVER_TOLERANCE_PX):
+        self.ax = ax
+        self.points = np.column_stack([x, y]).astype(np.float64)
+        self.row_index = row_index
+        self.ids = ids
+        self.id_name = id_name
+        self.categories = categories
+        self.tolerance_px = tolerance_px
+        self._current = None
+
+        # 軸ごとのスケールを揃えた座標でKD木を作る (表示上の距離に近づけるため)
+        self.scale = np.ptp(self.points, axis=0)
+        self.scale[self.scale == 0] = 1.0
+        self.tree = cKDTree(self.points / self.scale)
+
+        self.annotation = ax.annotate(
+            "", xy=(0, 0), xytext=(15, 15), textcoords='offset points', color=text_color, zorder=10,
+            bbox=dict(boxstyle='round', facecolor='#4C566A', alpha=0.95, edgecolor="#E5E9F0"),
+            arrowprops=dict(arrowstyle="->", color=text_color, alpha=0.7), annotation_clip=False,
+        )
+        self.annotation.set_visible(False)
+        ax.figure.canvas.mpl_connect('motion_notify_event', self._on_move)
+
+    def nearest(self, x_data, y_data):
+        # 許容ピクセル内で最も近い点の添字を返す。なければNone
+        to_display = self.ax.transData
+        mouse_px = to_display.transform((x_data, y_data))
+        # 許容ピクセルをデータ座標に換算し、スケール済み座標での探索半径とする (楕円を内包する円で候補を絞る)
+        corner = to_display.inverted().transform(mouse_px + self.tolerance_px)
+        radius = np.max(np.abs(corner - (x_data, y_data)) / self.scale)
+        candidates = self.tree.query_ball_point((x_data / self.scale[0], y_data / self.scale[1]), radius, return_sorted=False)
+        if not candidates:
+            return None
+        candidates = np.asarray(candidates)
+        distances = np.hypot(*(to_display.transform(self.points[candidates]) - mouse_px).T)
+        best = np.argmin(distances)
+        return candidates[best] if distances[best] <= self.tolerance_px else None
+
+    def _on_move(self, event):
+        hit = None
+        if event.inaxes is self.ax and event.xdata is not None:
+            hit = self.nearest(event.xdata, event.ydata)
+        if hit == self._current:
+            return
+        self._current = hit
+        if hit is None:
+            self.annotation.set_visible(False)
+        else:
+            text_lines = [f"{self.id_name}: {self.ids[hit]}", f"Index: {self.row_index[hit]}"]
+            if self.categories is not None: text_lines.append(f"Category: {self.categories[hit]}")
+            self.annotation.set_text('\n'.join(text_lines))
+            self.annotation.xy = self.points[hit]
+            self.annotation.set_visible(True)
+        self.ax.figure.canvas.draw_idle()
+
+
+def draw_scatter_legend(ax):
+    legend = ax.legend(title='Category', frameon=True, facecolor='white', edgecolor='black', labelcolor='black')
+    if legend.get_title(): legend.get_title().set_color('black')
+
+
+def create_scatter_figure(result, style_map=None):
+    # 戻り値は (Figure, カテゴリ名 → 散布図アーティストの辞書, 密度表示の場合はDensityScatter・それ以外はNone)
+    matplotlib.style.use('default')
+    matplotlib.rcParams.update({'font.family': 'serif', 'font.size': 12, 'axes.linewidth': 1.5})
+    fig = Figure(figsize=(10, 7), facecolor='white')
+    ax = fig.add_subplot()
+    ax.set_facecolor('white')
+
+    has_category = result.has_category
+    use_density = len(result.pc_df) >= DENSITY_MODE_MIN_POINTS
+    scatter_artists = {}
+    density_scatter = None
+
+    if use_density:
+        if has_category and style_map:
+            groups, styles = [], {}
+            for category_name, group_df in result.pc_df.groupby('category'):
+                groups.append((category_name, group_df['PC1'].to_numpy(), group_df['PC2'].to_numpy()))
+                styles[category_name] = style_map.get(str(category_name), DEFAULT_CATEGORY_STYLE)
+        else:
+            groups = [(None, result.pc_df['PC1'].to_numpy(), result.pc_df['PC2'].to_numpy())]
+            styles = {None: {'color': 'blue', 'marker': 'o'}}
+        density_scatter = DensityScatter(ax, groups, styles)
+        if has_category and style_map:
+            draw_scatter_legend(ax)
+    elif has_category and style_map:
+        for category_name, group_df in result.pc_df.groupby('category'):
+            style = style_map.get(str(category_name), DEFAULT_CATEGORY_STYLE)
+            scatter = ax.scatter(group_df['PC1'], group_df['PC2'], c=style['color'], marker=style['marker'], label=category_name,
+                                 alpha=0.7, s=50, edgecolors=_scatter_edge_color(style['color']), linewidths=0.5)
+            scatter.set_gid(category_name)
+            scatter_artists[category_name] = scatter
+        draw_scatter_legend(ax)
+    else:
+        ax.scatter(result.pc_df['PC1'], result.pc_df['PC2'], alpha=0.7, c='blue', edgecolors='k', linewidths=0.5)
+
+    ax.set_title('Principal Component Analysis (2D Scatter Plot)', color='black', fontweight='bold')
+    ax.set_xlabel(f'Principal Component 1 ({result.pca.explained_variance_ratio_[0]:.2%})', color='black')
+    ax.set_ylabel(f'Principal Component 2 ({result.pca.explained_variance_ratio_[1]:.2%})', color='black')
+
+    for spine in ax.spines.values(): spine.set_color('black')
+    ax.tick_params(axis='x', colors='black'); ax.tick_params(axis='y', colors='black')
+    ax.grid(True, color='#CCCCCC', linestyle='--', linewidth=0.5)
+    ax.axhline(0, color='grey', lw=0.8, ls='--'); ax.axvline(0, color='grey', lw=0.8, ls='--')
+
+    fig.tight_layout(pad=2.0)
+    return fig, scatter_artists, density_scatter
+
+
+def create_explained_variance_figure(result, stability=None):
+    # stability (pca_stability.StabilityResult) があれば、ブートストラップの信頼区間をひげで、
+    # 置換検定で偶然に得られる寄与率の上側95%点を破線で重ねる
+    matplotlib.style.use('default')
+    fig = Figure(figsize=(10, 7), facecolor='white')
+    ax1 = fig.add_subplot()
+    ax1.set_facecolor('white')
+    variance_ratio = result.pca.explained_variance_ratio_
+    cum_variance_ratio = np.cumsum(variance_ratio)
+    pc_labels = [f'PC{i+1}' for i in range(len(variance_ratio))]
+    ax1.bar(pc_labels, variance_ratio, alpha=0.7, color='steelblue', label='Explained Variance Ratio')
+    if stability is not None and stability.method == 'bootstrap':
+        low, high = stability.ratio_interval()
+        yerr = np.clip([variance_ratio - low, high - variance_ratio], 0, None)
+        ax1.errorbar(pc_labels, variance_ratio, yerr=yerr, fmt='none', ecolor='black', elinewidth=1.2, capsize=4,
+                     label=f'95% Bootstrap CI (n={stability.n_replicates})')
+    elif stability is not None:
+        ax1.plot(pc_labels, stability.null_ratio_quantile(), color='dimgray', ls='--', marker='_', markersize=12,
+                 label=f'Permutation 95% Null (n={stability.n_replicates})')
+    ax1.set_xlabel('Principal Components', color='black', fontweight='bold')
+    ax1.set_ylabel('Explained Variance Ratio', color='black')
+    ax1.tick_params(axis='y', labelcolor='black'); ax1.tick_params(axis='x', colors='black', rotation=45)
+    ax2 = ax1.twinx()
+    ax2.plot(pc_labels, cum_variance_ratio, color='firebrick', marker='o', linestyle='-', label='Cumulative Explained Variance')
+    ax2.set_ylabel('Cumulative Explained Variance', color='black')
+    ax2.tick_params(axis='y', labelcolor='black'); ax2.set_ylim(0, 1.05)
+    ax1.set_title('Explained Variance by Principal Components', color='black', fontweight='bold')
+    fig.legend(loc="upper right", bbox_to_anchor=(0.9, 0.9), bbox_transform=ax1.transAxes)
+    for spine in ax1.spines.values(): spine.set_color('black')
+    for spine in ax2.spines.values(): spine.set_color('black')
+    fig.tight_layout()
+    return fig
+
+
+# --- ローディングプロット: 矢印は1回のquiverで描き、ラベルは寄与の大きい上位k変数だけに付ける ---
+LOADINGS_TOP_K = 20
+LOADINGS_AXIS_LIMIT = 1.1
+
+
+def top_loading_indices(loadings, top_k):
+    # 表示中の2成分でのローディングの大きさ (原点からの距離) が大きい順に、上位k変数のインデックスを返す
+    magnitude = np.hypot(loadings[:, 0], loadings[:, 1])
+    top_k = max(0, min(top_k, len(magnitude)))
+    if top_k == 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(magnitude, len(magnitude) - top_k)[-top_k:]
+    return top[np.argsort(magnitude[top])[::-1]]
+
+
+def draw_loadings(ax, result, pc_x=0, pc_y=1, top_k=LOADINGS_TOP_K, stability=None):
+    # 軸の内容を描き直す。GUIではPCの組やkを変えるたびにFigureを作り直さずこれを呼ぶ
+    # ブートストラップの結果 (stability) があれば、ラベルを付けた変数の矢印の先に95%信頼区間のひげを付ける
+    ax.clear()
+    ax.set_facecolor('white')
+    components = result.pca.components_
+    loadings = np.column_stack([components[pc_x], components[pc_y]])
+    top = top_loading_indices(loadings, top_k)
+    rest = np.ones(len(loadings), dtype=bool)
+    rest[top] = False
+
+    # ラベルを付けない変数は矢印にせず点群として描く (数千変数でもアーティストは1つ)
+    if rest.any():
+        ax.scatter(loadings[rest, 0], loadings[rest, 1], s=4, c='grey', alpha=0.5, linewidths=0, label='_nolegend_')
+    if len(top):
+        ax.quiver(np.zeros(len(top)), np.zeros(len(top)), loadings[top, 0], loadings[top, 1],
+                  angles='xy', scale_units='xy', scale=1, width=0.004, color='darkred', alpha=0.7)
+        if stability is not None and stability.method == 'bootstrap':
+            low, high = stability.loading_interval()
+            tips = loadings[top]
+            xerr = np.clip([tips[:, 0] - low[pc_x, top], high[pc_x, top] - tips[:, 0]], 0, None)
+            yerr = np.clip([tips[:, 1] - low[pc_y, top], high[pc_y, top] - tips[:, 1]], 0, None)
+            ax.errorbar(tips[:, 0], tips[:, 1], xerr=xerr, yerr=yerr, fmt='none', ecolor='navy', elinewidth=1, capsize=2, alpha=0.8)
+    variable_names = result.numerical_df_columns
+    for i in top:
+        ax.text(loadings[i, 0] * 1.15, loadings[i, 1] * 1.15, variable_names[i], color='black', ha='center', va='center',
+                bbox=dict(boxstyle="round,pad=0.3", fc="white", ec="none", alpha=0.7))
+
+    ax.set_xlabel(f'Principal Component {pc_x + 1} Loadings', color='black')
+    ax.set_ylabel(f'Principal Component {pc_y + 1} Loadings', color='black')
+    title = 'Loadings Plot' if not rest.any() else f'Loadings Plot (top {len(top)} of {len(loadings)} variables labeled)'
+    ax.set_title(title, color='black', fontweight='bold')
+    # 全変数にラベルを付ける場合は単位円全体を、変数が多い場合はローディングの広がりに合わせて表示する
+    limit = LOADINGS_AXIS_LIMIT
+    if rest.any():
+        limit = min(limit, 1.3 * np.abs(loadings).max())
+    ax.set_xlim(-limit, limit); ax.set_ylim(-limit, limit)
+    ax.axhline(0, color='grey', ls='--', lw=0.8); ax.axvline(0, color='grey', ls='--', lw=0.8)
+    ax.grid(True, color='#CCCCCC', ls='--', lw=0.5)
+    for spine in ax.spines.values(): spine.set_color('black')
+    ax.tick_params(axis='x', colors='black'); ax.tick_params(axis='y', colors='black')
+    circle = Circle((0, 0), 1, color='gray', fill=False, ls='--', alpha=0.7)
+    ax.add_artist(circle)
+
+
+def create_loadings_figure(result, pc_x=0, pc_y=1, top_k=LOADINGS_TOP_K, stability=None):
+    matplotlib.style.use('default')
+    fig = Figure(figsize=(8, 8), facecolor='white')
+    ax = fig.add_subplot()
+    draw_loadings(ax, result, pc_x, pc_y, top_k, stability)
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,199 @@
+"""PCA Visualizer の疎行列入力 (密な行列を作らずに標準化・PCAを行う)。
+
+対応する入力:
+    - scipy.sparse.save_npz で保存した .npz (CSR/CSC/COO)。
+      同じフォルダの <名前>_labels.csv (1列目がID、任意で category 列) と <名前>_features.csv (1列目が列名) があれば使う。
+    - 行・列・値の3列 (ヘッダーが row,column,value。任意で category 列) を持つ縦持ちのCSV。
+
+標準化は列ごとの標準偏差で割る (疎性を保つ)。平均の引き算は行列に対して行わず、
+中心化する場合は線形作用素として svds に渡し、中心化しない場合は TruncatedSVD で学習する。
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator, svds
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.preprocessing import StandardScaler
+
+from pca_core import RANDOMIZED_ITERATED_POWER, DataError, PcaResult
+
+TRIPLET_COLUMNS = ['row', 'column', 'value']
+SPARSE_MAX_COMPONENTS = 10
+
+
+def _sidecar_path(path, suffix):
+    return os.path.splitext(path)[0] + suffix
+
+
+def _triplet_header(path):
+    # 縦持ちCSVなら列名のリストを、それ以外はNoneを返す
+    try:
+        header = [str(col).strip().lower() for col in pd.read_csv(path, nrows=0).columns]
+    except (ValueError, UnicodeDecodeError, pd.errors.ParserError):
+        return None
+    if header[:3] == TRIPLET_COLUMNS and set(header[3:]) <= {'category'}:
+        return header
+    return None
+
+
+def is_sparse_input(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npz':
+        return True
+    return ext == '.csv' and _triplet_header(path) is not None
+
+
+def category_source_path(path):
+    # スタイル設定のカテゴリ一覧を読むファイル (.npz ではラベルのCSV。なければNone)
+    if os.path.splitext(path)[1].lower() != '.npz':
+        return path
+    labels_path = _sidecar_path(path, '_labels.csv')
+    return labels_path if os.path.exists(labels_path) else None
+
+
+def _load_npz(path):
+    matrix = sp.load_npz(path).tocsr()
+    n_rows, n_cols = matrix.shape
+
+    labels_path = _sidecar_path(path, '_labels.csv')
+    if os.path.exists(labels_path):
+        labels = pd.read_csv(labels_path)
+        if len(labels) != n_rows:
+            raise DataError(f"{os.path.basename(labels_path)} の行数 ({len(labels)}) が行列の行数 ({n_rows}) と一致しません。")
+        labels = labels[[labels.columns[0]] + (['category'] if 'category' in labels.columns[1:] else [])]
+    else:
+        labels = pd.DataFrame({'row': np.arange(n_rows)})
+
+    features_path = _sidecar_path(path, '_features.csv')
+    if os.path.exists(features_path):
+        features = pd.read_csv(features_path).iloc[:, 0].astype(str)
+        if len(features) != n_cols:
+            raise DataError(f"{os.path.basename(features_path)} の行数 ({len(features)}) が行列の列数 ({n_cols}) と一致しません。")
+        features = pd.Index(features)
+    else:
+        features = pd.Index([f'col{j}' for j in range(n_cols)])
+    return matrix, labels, features
+
+
+def _load_triplets(path, header):
+    # 行・列の識別子は出現順に番号を振る。同じ (行, 列) が複数あれば値を合計する
+    usecols = [0, 1, 2] + ([3] if len(header) > 3 else [])
+    triplets = pd.read_csv(path, usecols=usecols)
+    triplets.columns = header
+    row_codes, row_ids = pd.factorize(triplets['row'])
+    col_codes, col_ids = pd.factorize(triplets['column'])
+    values = pd.to_numeric(triplets['value'], errors='coerce').to_numpy(dtype=np.float64)
+    if np.isnan(values).any():
+        raise DataError("value 列に数値でない値または欠損値があります。")
+    matrix = sp.coo_matrix((values, (row_codes, col_codes)), shape=(len(row_ids), len(col_ids))).tocsr()
+
+    labels = pd.DataFrame({'row': row_ids})
+    if 'category' in header:
+        # カテゴリは行ごとに最初に現れた値を使う
+        labels['category'] = triplets['category'].groupby(row_codes).first().to_numpy()
+    return matrix, labels, pd.Index(col_ids.astype(str))
+
+
+def _column_scaler(matrix):
+    # 列の平均・分散は StandardScaler (with_mean=False) で疎行列のまま求める (E[x²]-E[x]² と違い桁落ちしない2パスの計算)
+    # 定数列の判定には scikit-learn と同じ丸め誤差の上限を使い、定数でない列の印も返す
+    scaler = StandardScaler(with_mean=False).fit(matrix)
+    n_rows = matrix.shape[0]
+    eps = np.finfo(np.float64).eps
+    constant = scaler.var_ <= n_rows * eps * scaler.var_ + (n_rows * scaler.mean_ * eps) ** 2
+    scaler.scale_[constant] = 1.0
+    return scaler, ~constant
+
+
+def _centered_operator(matrix, mean, scale):
+    # (X - 1 μᵀ) D⁻¹ を、X を密にせずに掛け算だけで表す
+    shift = mean / scale
+
+    def matmat(v):
+        v = v.reshape(matrix.shape[1], -1)
+        return matrix @ (v / scale[:, np.newaxis]) - np.outer(np.ones(matrix.shape[0]), shift @ v)
+
+    def rmatmat(u):
+        u = u.reshape(matrix.shape[0], -1)
+        return (matrix.T @ u - np.outer(mean, u.sum(axis=0))) / scale[:, np.newaxis]
+
+    return LinearOperator(matrix.shape, matvec=lambda v: matmat(v).ravel(), rmatvec=lambda u: rmatmat(u).ravel(),
+                          matmat=matmat, rmatmat=rmatmat, dtype=np.float64)
+
+
+def _pca_from_svd(components, singular_values, n_samples, total_variance, mean):
+    # SVDの結果から、fit済みのPCAと同じ属性を持つオブジェクトを組み立てる
+    # 符号は各成分で絶対値最大の要素が正になるようにそろえる
+    signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+    signs[signs == 0] = 1
+    components = components * signs[:, np.newaxis]
+    n_components, n_features = components.shape
+    explained_variance = singular_values ** 2 / (n_samples - 1)
+    pca = PCA(n_components=n_components)
+    pca.n_features_in_ = n_features
+    pca.n_samples_ = n_samples
+    pca.n_components_ = n_components
+    pca.mean_ = mean
+    pca.components_ = components
+    pca.explained_variance_ = explained_variance
+    pca.explained_variance_ratio_ = explained_variance / total_variance if total_variance > 0 else np.zeros(n_components)
+    pca.singular_values_ = singular_values
+    remaining = min(n_samples, n_features) - n_components
+    pca.noise_variance_ = max(total_variance - explained_variance.sum(), 0) / remaining if remaining > 0 else 0.0
+    return pca, signs
+
+
+def analyze_sparse(file_path, check_stage=None, center=True):
+    if check_stage is None:
+        check_stage = lambda stage: None
+
+    check_stage('reading')
+    if os.path.splitext(file_path)[1].lower() == '.npz':
+        matrix, labels, features = _load_npz(file_path)
+    else:
+        matrix, labels, features = _load_triplets(file_path, _triplet_header(file_path))
+    matrix = matrix.astype(np.float64)
+    n_rows, n_cols = matrix.shape
+    if n_rows < 3 or n_cols < 2:
+        raise DataError("分析には少なくとも3行・2列以上のデータが必要です。")
+    # ARPACK と TruncatedSVD は行数・列数より少ない成分数しか求められない
+    n_components = min(SPARSE_MAX_COMPONENTS, min(n_rows, n_cols) - 1)
+
+    check_stage('scaling')
+    scaler, varying = _column_scaler(matrix)
+
+    check_stage('fitting')
+    start = time.perf_counter()
+    # 標準化後の各列の分散 (不偏) の合計。定数列は0になる
+    total_variance = np.count_nonzero(varying) * n_rows / (n_rows - 1)
+    if center:
+        operator = _centered_operator(matrix, scaler.mean_, scaler.scale_)
+        v0 = np.random.default_rng(0).standard_normal(min(n_rows, n_cols))
+        u, s, vt = svds(operator, k=n_components, v0=v0)
+        order = np.argsort(s)[::-1]
+        u, s, vt = u[:, order], s[order], vt[order]
+        pca, signs = _pca_from_svd(vt, s, n_rows, total_variance, np.zeros(n_cols))
+        scores = u * (s * signs)
+        solver = 'svds (sparse, centered)'
+    else:
+        # 平均を引かずに標準偏差で割るだけなので、行列は疎のまま
+        scaler.mean_ = np.zeros(n_cols)
+        scaled = matrix @ sp.diags(1 / scaler.scale_)
+        svd = TruncatedSVD(n_components=n_components, algorithm='randomized', n_iter=RANDOMIZED_ITERATED_POWER, random_state=0)
+        scores = svd.fit_transform(scaled)
+        pca, signs = _pca_from_svd(svd.components_, svd.singular_values_, n_rows, total_variance, np.zeros(n_cols))
+        # 中心化しないので特異値からは分散が求まらない。寄与率は TruncatedSVD がスコアの分散から求めた値を使う
+        pca.explained_variance_ = svd.explained_variance_
+        pca.explained_variance_ratio_ = svd.explained_variance_ratio_
+        scores = scores * signs
+        solver = 'truncated_svd (sparse, uncentered)'
+    fit_info = {'solver': solver, 'seconds': time.perf_counter() - start, 'input': 'sparse', 'nnz': int(matrix.nnz)}
+
+    pc_cols = [f'PC{i+1}' for i in range(n_components)]
+    pc_df = pd.DataFrame(scores, columns=pc_cols, copy=False)
+    if 'category' in labels.columns:
+        pc_df['category'] = labels['category'].astype(str).to_numpy()
+    return PcaResult(labels, features, scaler, pca, scores, pc_df, fit_info)
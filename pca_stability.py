@@ -0,0 +1,202 @@
+"""PCA Visualizer の安定性評価 (ブートストラップ・置換検定)。
+
+行を復元抽出 (ブートストラップ) または列ごとに並べ替え (置換検定) したデータでPCAを何度も学習し直し、
+寄与率とローディングのばらつきを求める。再学習はプロセスプールで並列に行い、
+データ行列は一時ファイル (.npy) に一度だけ書き出して各プロセスがメモリマップで共有する
+(タスクごとに行列をpickleして送らない)。
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+from pca_core import PCA_SOLVERS, DataError, fit_pca
+
+STABILITY_METHODS = ('bootstrap', 'permutation')
+DEFAULT_REPLICATES = 200
+CONFIDENCE_LEVEL = 0.95
+# 1タスクにまとめる再学習の回数は、各プロセスに数タスクずつ行き渡る程度にする (進捗表示とキャンセルの粒度)
+TASKS_PER_WORKER = 4
+MATRIX_CHUNK_ROWS = 100_000
+FILE_CHANGED_MESSAGE = "分析した後にCSVファイルの行数が変わっています。もう一度分析してから安定性を評価してください。"
+
+# --- ワーカープロセス側の状態 (プールの初期化時にメモリマップを開く) ---
+_worker_data = None
+
+
+def _init_worker(matrix_path, threads_per_worker):
+    global _worker_data
+    # 各プロセスのBLASスレッド数を抑え、プロセス数に比例して処理量が伸びるようにする
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(threads_per_worker)
+    _worker_data = np.load(matrix_path, mmap_mode='r')
+
+
+def _resample(data, method, rng):
+    n_rows = len(data)
+    if method == 'bootstrap':
+        # 並べ替えた添字で取り出すと、メモリマップを先頭から順に読むことになる
+        return data[np.sort(rng.integers(n_rows, size=n_rows))]
+    # 置換検定: 列ごとに独立に行を並べ替え、列間の相関だけを壊す
+    sample = np.empty(data.shape)
+    for j in range(data.shape[1]):
+        sample[:, j] = data[rng.permutation(n_rows), j]
+    return sample
+
+
+def _run_replicates(method, seeds, n_components, solver, reference_components):
+    # 置換検定では成分の向きに意味がないので、寄与率だけを返す
+    ratios = np.empty((len(seeds), n_components))
+    components = np.empty((len(seeds), n_components, reference_components.shape[1])) if method == 'bootstrap' else None
+    for i, seed in enumerate(seeds):
+        sample = _resample(_worker_data, method, np.random.default_rng(seed))
+        scaled = StandardScaler(copy=False).fit_transform(sample)
+        pca, _, _ = fit_pca(scaled, n_components, solver, copy=False)
+        ratios[i] = pca.explained_variance_ratio_
+        if components is not None:
+            # 成分の符号は任意なので、基準のPCAの成分と内積が正になる向きにそろえる
+            signs = np.sign(np.einsum('ij,ij->i', pca.components_, reference_components))
+            signs[signs == 0] = 1
+            components[i] = pca.components_ * signs[:, np.newaxis]
+    return ratios, components
+
+
+class StabilityResult:
+    """再学習した各回の寄与率と (符号をそろえた) 成分。信頼区間や置換検定のp値はここから求める。"""
+
+    def __init__(self, method, ratios, components, observed_ratios):
+        self.method = method
+        # ratios: (回数 × 成分数)、components: (回数 × 成分数 × 変数数。置換検定ではNone)
+        self.ratios = ratios
+        self.components = components
+        self.observed_ratios = observed_ratios
+        self._loading_intervals = {}
+
+    @property
+    def n_replicates(self):
+        return len(self.ratios)
+
+    def ratio_interval(self, level=CONFIDENCE_LEVEL):
+        # 寄与率のパーセンタイル区間 (下限, 上限)
+        return np.quantile(self.ratios, [(1 - level) / 2, (1 + level) / 2], axis=0)
+
+    def loading_interval(self, level=CONFIDENCE_LEVEL):
+        # 成分ごと・変数ごとのローディングのパーセンタイル区間。形は (2, 成分数, 変数数)
+        # ローディングプロットはPCの組を変えるたびに描き直すので、水準ごとに一度だけ計算する
+        if level not in self._loading_intervals:
+            self._loading_intervals[level] = np.quantile(self.components, [(1 - level) / 2, (1 + level) / 2], axis=0)
+        return self._loading_intervals[level]
+
+    def null_ratio_quantile(self, level=CONFIDENCE_LEVEL):
+        # 置換検定で相関のないデータから得られる寄与率の上側分位点 (偶然で説明できる寄与率の目安)
+        return np.quantile(self.ratios, level, axis=0)
+
+    def permutation_pvalues(self):
+        return (1 + (self.ratios >= self.observed_ratios).sum(axis=0)) / (self.n_replicates + 1)
+
+    def significant_components(self, alpha=0.05):
+        # 先頭から連続して、偶然 (置換検定) より大きい寄与率を持つ成分の数
+        significant = self.permutation_pvalues() < alpha
+        return len(significant) if significant.all() else int(np.argmin(significant))
+
+
+def stability_unsupported_reason(result):
+    # 安定性評価に対応していない結果なら、その理由を返す (対応していればNone)
+    if result.fit_info.get('input') == 'sparse':
+        # 再学習のたびに密な行列を作ることになるため
+        return "疎行列入力の結果では安定性評価に対応していません。"
+    if result.fit_info.get('solver') == 'incremental':
+        # 各プロセスが再標本化のたびに行数×列数のfloat64の行列をメモリ上に作るため、ストリーミングで扱う大きさでは収まらない
+        return "ストリーミングモードで分析した結果では安定性評価に対応していません。"
+    return None
+
+
+def _write_matrix(result, file_path):
+    # 学習に使った数値列を、各プロセスがメモリマップで読む一時ファイルに書き出す
+    # (省メモリモードやキャッシュからの結果では、数値列をCSVからチャンク単位で読み直す)
+    columns = list(result.numerical_df_columns)
+    n_rows = len(result.scores)
+    if all(col in result.df.columns for col in columns):
+        chunks = (result.df[columns].iloc[start:start + MATRIX_CHUNK_ROWS] for start in range(0, len(result.df), MATRIX_CHUNK_ROWS))
+    else:
+        chunks = pd.read_csv(file_path, usecols=columns, chunksize=MATRIX_CHUNK_ROWS)
+    fd, matrix_path = tempfile.mkstemp(prefix='pca_stability_', suffix='.npy')
+    os.close(fd)
+    matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float64, shape=(n_rows, len(columns)))
+    start = 0
+    try:
+        for chunk in chunks:
+            stop = start + len(chunk)
+            # 分析した後にCSVが書き換えられていると、スコアと行が対応しなくなる
+            if stop > n_rows:
+                raise DataError(FILE_CHANGED_MESSAGE)
+            matrix[start:stop] = chunk[columns].to_numpy(dtype=np.float64)
+            start = stop
+        if start != n_rows:
+            raise DataError(FILE_CHANGED_MESSAGE)
+        matrix.flush()
+    except BaseException:
+        matrix = None
+        _remove_matrix(matrix_path)
+        raise
+    del matrix
+    return matrix_path
+
+
+def _remove_matrix(matrix_path):
+    try:
+        os.remove(matrix_path)
+    except OSError:
+        pass
+
+
+def run_stability(result, file_path, method='bootstrap', n_replicates=DEFAULT_REPLICATES, workers=None, seed=0,
+                  check_progress=None):
+    # check_progress(完了した回数, 全体の回数) はタスクが終わるたびに呼ばれ、AnalysisCancelled を送出すれば中断できる
+    if method not in STABILITY_METHODS:
+        raise ValueError(f"未知の評価方法です: {method}")
+    reason = stability_unsupported_reason(result)
+    if reason is not None:
+        raise DataError(reason)
+    if check_progress is None:
+        check_progress = lambda done, total: None
+    workers = max(1, min(workers or os.cpu_count() or 1, n_replicates))
+    n_components = result.pca.n_components_
+    reference_components = np.asarray(result.pca.components_, dtype=np.float64)
+    # ソルバーは元の学習と同じものを使う (キャッシュの差分更新では auto)
+    solver = result.fit_info.get('solver')
+    if solver not in PCA_SOLVERS:
+        solver = 'auto'
+
+    # 乱数は回ごとに独立した系列にし、プロセス数やタスクの分け方によらず同じ結果にする
+    seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+    batch_size = max(1, -(-n_replicates // (workers * TASKS_PER_WORKER)))
+    batches = [seeds[start:start + batch_size] for start in range(0, n_replicates, batch_size)]
+
+    check_progress(0, n_replicates)
+    matrix_path = _write_matrix(result, file_path)
+    ratios = [None] * len(batches)
+    components = [None] * len(batches)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(matrix_path, max(1, (os.cpu_count() or 1) // workers))) as executor:
+            futures = {executor.submit(_run_replicates, method, batch, n_components, solver, reference_components): i
+                       for i, batch in enumerate(batches)}
+            done = 0
+            try:
+                for future in as_completed(futures):
+                    i = futures[future]
+                    ratios[i], components[i] = future.result()
+                    done += len(batches[i])
+                    check_progress(done, n_replicates)
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+    finally:
+        _remove_matrix(matrix_path)
+
+    return StabilityResult(method, np.concatenate(ratios), np.concatenate(components) if method == 'bootstrap' else None,
+                           np.asarray(result.pca.explained_variance_ratio_))
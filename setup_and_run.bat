@@ -22,7 +22,7 @@ if not exist "%VENV_DIR%\Scripts\python.exe" (
     )
 
     echo CuCXg[܂...
-    call %VENV_DIR%\Scripts\pip.exe install pandas scikit-learn matplotlib mplcursors
+    call %VENV_DIR%\Scripts\pip.exe install pandas scikit-learn matplotlib pyarrow
     if %errorlevel% neq 0 (
         echo CũCXg[Ɏs܂BC^[lbgڑmFĂB
         pause
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# テストはリポジトリ直下のモジュール (pca_core など) をそのまま読み込む
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_configure(config):
+    # 時間のかかるテスト (100回の繰り返しや大きな合成データ)。-m "not slow" で除外できる
+    config.addinivalue_line('markers', 'slow: 実行に1分以上かかるテスト')
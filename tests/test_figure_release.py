@@ -0,0 +1,143 @@
+"""分析とグラフ作成を100回繰り返しても、Figureが残らずメモリが増え続けないことの確認。
+
+GUI (PcaApp) のグラフ作成と解放のメソッドをそのまま使い、Tkのウィジェットだけを同じ操作を持つ代用品に置き換える
+(表示のない環境でも、GUIが古いFigureへの参照を持ち続けていれば検出できる)。
+"""
+import gc
+import weakref
+
+import matplotlib
+# gui_pca_app は読み込み時にTkAggを指定するので、pyplotより先に読み込んでから描画をAggに切り替える
+from gui_pca_app import PcaApp
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from pca_core import analyze_csv
+from pca_plots import default_style_map
+
+N_RUNS = 100
+WARMUP_RUNS = 5
+# 100回で許容するRSSの増加 (アロケータの断片化などの揺らぎ分)
+RSS_TOLERANCE_BYTES = 20 * 1024 ** 2
+
+
+def _current_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.standard_normal((5_000, 20)), columns=[f'x{j}' for j in range(20)])
+    df.insert(0, 'ID', np.arange(len(df)))
+    df['category'] = rng.choice(['A', 'B', 'C', 'D'], len(df))
+    path = tmp_path / 'data.csv'
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+class _FakeWidget:
+    """Tkのウィジェットの代わり。destroy() で親から外れ、持っている参照 (Canvasなど) を手放す。"""
+
+    def __init__(self, parent=None, payload=None):
+        self.children = []
+        self.payload = payload
+        self.parent = parent
+        if parent is not None:
+            parent.children.append(self)
+
+    def winfo_children(self):
+        return list(self.children)
+
+    def destroy(self):
+        for child in self.winfo_children():
+            child.destroy()
+        if self.parent is not None:
+            self.parent.children.remove(self)
+        self.parent = self.payload = None
+
+
+class _FakeNotebook(_FakeWidget):
+    def tabs(self):
+        return [str(id(child)) for child in self.children]
+
+    def nametowidget(self, name):
+        return next(child for child in self.children if str(id(child)) == name)
+
+
+def _make_app():
+    # Tkのルートウィンドウを作らずに、グラフのタブの作成と解放に使う属性だけを用意する
+    app = PcaApp.__new__(PcaApp)
+    app.TEXT_COLOR = '#EAEAEA'
+    app.result = None
+    app.stability = None
+    app.scatter_hover = None
+    app.scatter_artists = {}
+    app.density_scatter = None
+    app.loadings_ax = None
+    app.plot_tabs = {}
+    app.notebook = _FakeNotebook()
+    return app
+
+
+def _run_once(app, csv_path, figure_refs):
+    # GUIの1回の実行 (_on_analysis_done) と同じく、前の結果とタブを解放 → 3つのタブのグラフを描画する
+    result = analyze_csv(csv_path)
+    if app.result is not None:
+        app.result.release()
+    app.result = result
+    app._release_plot_tabs()
+    style_map = default_style_map(result.pc_df['category'].unique())
+    plot_functions = [lambda: app._create_scatter_plot(style_map=style_map), app._create_explained_variance_plot,
+                      app._create_loadings_plot]
+    for plot_function in plot_functions:
+        # _add_plot_tab と _on_tab_changed の処理を、Tkのウィジェットを代用品にして行う
+        frame = _FakeWidget(app.notebook)
+        tab = {'frame': frame, 'plot_function': plot_function, 'controls_function': None,
+               'figure': None, 'canvas': None, 'toolbar': None}
+        app.plot_tabs[str(id(frame))] = tab
+        fig = tab['plot_function']()
+        canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        tab.update(figure=fig, canvas=canvas, toolbar=_FakeWidget(frame, payload=canvas))
+        _FakeWidget(frame, payload=canvas)
+        figure_refs.append(weakref.ref(fig))
+        del fig, canvas, tab
+    app.scatter_hover.nearest(0.0, 0.0)
+
+
+@pytest.mark.slow
+def test_figures_are_released_over_repeated_runs(csv_path):
+    app = _make_app()
+    figure_refs = []
+    for _ in range(WARMUP_RUNS):
+        _run_once(app, csv_path, figure_refs)
+    gc.collect()
+    rss_before = _current_rss_bytes()
+
+    for _ in range(N_RUNS):
+        _run_once(app, csv_path, figure_refs)
+    # 最後の結果も、別のファイルを分析し直したときと同じ処理で解放する
+    app._release_plot_tabs()
+    app.result.release()
+    gc.collect()
+    rss_after = _current_rss_bytes()
+
+    # pyplotのFigureマネージャーには何も登録されず、GUIが参照を手放したFigureはすべて回収される
+    assert plt.get_fignums() == []
+    assert app.notebook.tabs() == []
+    assert [ref for ref in figure_refs if ref() is not None] == []
+    if rss_before is None:
+        pytest.skip("RSSを取得できない環境です (/proc/self/status がない)")
+    assert rss_after - rss_before < RSS_TOLERANCE_BYTES, f"RSSが {(rss_after - rss_before) / 1024 ** 2:.1f}MB 増えました"
@@ -0,0 +1,97 @@
+"""学習結果キャッシュで末尾に行を追記したCSVを差分更新した結果が、最初から分析し直した結果と一致することの確認。"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pca_cache import FitCache
+from pca_core import analyze_csv
+
+N_ROWS = 3_000
+N_APPENDED = 500
+N_COLUMNS = 12
+# 寄与率がはっきり分かれる (隣り合う成分の分散が1.4倍ずつ違う) 直交基底
+SPECTRUM = 1.4 ** -np.arange(N_COLUMNS)
+
+# モードごとの analyze_csv の引数 (ストリーミングはしきい値を1バイトにして必ず切り替える)
+MODES = {
+    'in_memory': {'streaming_threshold_bytes': float('inf')},
+    'low_memory': {'streaming_threshold_bytes': float('inf'), 'low_memory': True},
+    'streaming': {'streaming_threshold_bytes': 1},
+}
+
+
+def _write_rows(path, start, n_rows, rng, header, basis_seed=0):
+    # 追記する行は basis_seed を変えて主成分の向きを動かす (更新前と後で成分が入れ替わる場合も確かめる)
+    basis = np.linalg.qr(np.random.default_rng(basis_seed).standard_normal((N_COLUMNS, N_COLUMNS)))[0].T
+    data = rng.standard_normal((n_rows, N_COLUMNS)) * np.sqrt(SPECTRUM) @ basis
+    df = pd.DataFrame(data, columns=[f'x{j}' for j in range(N_COLUMNS)])
+    df.insert(0, 'ID', np.arange(start, start + n_rows))
+    df['category'] = rng.choice(['A', 'B', 'C'], n_rows)
+    df.to_csv(path, mode='w' if header else 'a', header=header, index=False, float_format='%.6f')
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+@pytest.mark.parametrize('solver', ['auto', 'full', 'randomized', 'covariance_eigh'])
+def test_append_matches_fresh_analysis(tmp_path, solver, mode):
+    rng = np.random.default_rng(0)
+    csv_path = str(tmp_path / 'data.csv')
+    _write_rows(csv_path, 0, N_ROWS, rng, header=True)
+    cache = FitCache(cache_dir=str(tmp_path / 'cache'))
+    kwargs = dict(MODES[mode], solver=solver)
+
+    first = cache.analyze_csv(csv_path, **kwargs)
+    assert first.fit_info.get('cache') is None
+    first.release()
+
+    _write_rows(csv_path, N_ROWS, N_APPENDED, rng, header=False, basis_seed=1)
+    appended = cache.analyze_csv(csv_path, **kwargs)
+    assert appended.fit_info['cache'] == 'appended'
+    assert appended.fit_info['appended_rows'] == N_APPENDED
+
+    fresh = analyze_csv(csv_path, **kwargs)
+    # 全行を射影し直しているので、符号も含めて最初から分析した結果とそろう
+    # (ストリーミングは IncrementalPCA の近似解、省メモリモードはfloat32で計算するので許容誤差を広げる)
+    atol = {'in_memory': 1e-8, 'low_memory': 1e-4, 'streaming': 1e-3}[mode]
+    np.testing.assert_allclose(appended.pca.explained_variance_ratio_, fresh.pca.explained_variance_ratio_, atol=atol)
+    np.testing.assert_allclose(appended.pca.components_, fresh.pca.components_, atol=atol)
+    np.testing.assert_allclose(appended.scores, fresh.scores, atol=atol * 100)
+    assert appended.df['ID'].tolist() == fresh.df['ID'].tolist()
+    assert appended.pc_df['category'].tolist() == fresh.pc_df['category'].tolist()
+    fresh_scores = np.array(fresh.scores)
+    fresh.release()
+    appended.release()
+
+    # 更新後のエントリはそのまま次回のキャッシュヒットになる
+    hit = cache.analyze_csv(csv_path, **kwargs)
+    assert hit.fit_info['cache'] == 'hit'
+    np.testing.assert_allclose(hit.scores, fresh_scores, atol=atol * 100)
+    hit.release()
+
+
+def test_append_without_room_in_cache_keeps_scores_in_temp_file(tmp_path, monkeypatch):
+    rng = np.random.default_rng(1)
+    csv_path = str(tmp_path / 'data.csv')
+    _write_rows(csv_path, 0, N_ROWS, rng, header=True)
+    cache = FitCache(cache_dir=str(tmp_path / 'cache'))
+    cache.analyze_csv(csv_path).release()
+
+    # エントリを保存できない場合も、CSVを読み直さずに射影済みのスコアを返す
+    _write_rows(csv_path, N_ROWS, N_APPENDED, rng, header=False)
+    monkeypatch.setattr(cache, '_write_entry', lambda *args: None)
+    reads = []
+    original_read_csv = pd.read_csv
+    monkeypatch.setattr(pd, 'read_csv', lambda *args, **kwargs: reads.append(kwargs) or original_read_csv(*args, **kwargs))
+    appended = cache.analyze_csv(csv_path)
+    assert appended.fit_info['cache'] == 'appended'
+    assert sum(1 for kwargs in reads if kwargs.get('chunksize')) == 1
+
+    monkeypatch.undo()
+    fresh = analyze_csv(csv_path)
+    np.testing.assert_allclose(appended.scores, fresh.scores, atol=1e-6)
+    scores_path = appended.scores_path
+    assert scores_path is not None
+    appended.release()
+    fresh.release()
+    assert not os.path.exists(scores_path)
@@ -0,0 +1,55 @@
+"""省メモリモードで、1M行×50列の合成データのピークメモリが通常モードの半分以下になることの確認。"""
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+N_ROWS = 1_000_000
+N_COLUMNS = 50
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 1回の分析を別プロセスで行い、段階ごとのピークメモリ (fit_info['peak_rss']) をJSONで出力する
+# (VmHWMはプロセス単位なので、モードごとにプロセスを分けて互いの影響をなくす)
+MEASURE_SCRIPT = """
+import json, sys
+from pca_core import analyze_csv
+result = analyze_csv(sys.argv[1], streaming_threshold_bytes=float('inf'), low_memory=sys.argv[2] == '1')
+print(json.dumps({'peak_rss': result.fit_info['peak_rss'], 'shape': list(result.scores.shape)}))
+"""
+
+
+@pytest.fixture(scope='module')
+def large_csv(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    path = tmp_path_factory.mktemp('low_memory') / 'data.csv'
+    chunk_rows = 200_000
+    for start in range(0, N_ROWS, chunk_rows):
+        df = pd.DataFrame(rng.standard_normal((chunk_rows, N_COLUMNS)), columns=[f'x{j}' for j in range(N_COLUMNS)])
+        df.insert(0, 'ID', np.arange(start, start + chunk_rows))
+        df['category'] = rng.choice(['A', 'B', 'C', 'D', 'E'], chunk_rows)
+        df.to_csv(path, mode='a', header=start == 0, index=False, float_format='%.4f')
+    return str(path)
+
+
+def _measure(csv_path, low_memory):
+    completed = subprocess.run([sys.executable, '-c', MEASURE_SCRIPT, csv_path, '1' if low_memory else '0'],
+                               cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.slow
+def test_low_memory_mode_halves_peak_memory(large_csv):
+    if not sys.platform.startswith('linux'):
+        pytest.skip("段階ごとのピークメモリはLinuxでのみ計測できる")
+    normal = _measure(large_csv, low_memory=False)
+    low = _measure(large_csv, low_memory=True)
+    assert normal['shape'] == low['shape'] == [N_ROWS, 10]
+
+    normal_peak = max(normal['peak_rss'].values())
+    low_peak = max(low['peak_rss'].values())
+    assert low_peak <= normal_peak / 2, (
+        f"省メモリモード {low_peak / 1024 ** 2:.0f}MB / 通常モード {normal_peak / 1024 ** 2:.0f}MB")
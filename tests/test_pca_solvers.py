@@ -0,0 +1,61 @@
+"""各PCAソルバーが完全SVDと同じ寄与率・(符号を除いて) 同じ成分を返すことの確認。"""
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+from pca_core import PCA_SOLVERS, choose_pca_solver, fit_pca
+
+N_COMPONENTS = 10
+
+
+def _low_rank_data(n_samples, n_features, spectrum, noise, seed):
+    # 指定した強さの潜在因子に等方的なノイズを加えたデータを標準化して返す
+    rng = np.random.default_rng(seed)
+    factors = rng.standard_normal((n_samples, len(spectrum))) * np.sqrt(spectrum)
+    basis = np.linalg.qr(rng.standard_normal((n_features, len(spectrum))))[0].T
+    data = factors @ basis * np.sqrt(n_features) + noise * rng.standard_normal((n_samples, n_features))
+    return StandardScaler().fit_transform(data)
+
+
+DATASETS = {
+    # 縦長 (行数が列数よりずっと多い)
+    'tall': lambda: _low_rank_data(20_000, 30, np.geomspace(8, 1, N_COMPONENTS), 1.0, 0),
+    # 横長 (列数が行数より多い)
+    'wide': lambda: _low_rank_data(600, 2_000, np.geomspace(8, 1, N_COMPONENTS), 1.0, 1),
+    # 寄与率がほぼ平坦 (隣り合う成分の分散の差が数%しかない)
+    'flat': lambda: _low_rank_data(3_000, 300, np.linspace(1.0, 0.75, N_COMPONENTS), 1.0, 2),
+}
+
+
+@pytest.fixture(scope='module', params=sorted(DATASETS))
+def dataset(request):
+    data = DATASETS[request.param]()
+    reference, _, _ = fit_pca(data, N_COMPONENTS, 'full')
+    return data, reference
+
+
+@pytest.mark.parametrize('solver', [solver for solver in PCA_SOLVERS if solver != 'full'])
+def test_solver_matches_full_svd(dataset, solver):
+    data, reference = dataset
+    pca, scores, fit_info = fit_pca(data, N_COMPONENTS, solver)
+
+    assert fit_info['solver'] in PCA_SOLVERS and fit_info['solver'] != 'auto'
+    assert fit_info['seconds'] >= 0
+    np.testing.assert_allclose(pca.explained_variance_ratio_, reference.explained_variance_ratio_, rtol=1e-6, atol=1e-10)
+
+    # 成分の符号は任意なので、基準の成分と内積が正になる向きにそろえてから比べる
+    signs = np.sign(np.einsum('ij,ij->i', pca.components_, reference.components_))
+    np.testing.assert_allclose(pca.components_ * signs[:, np.newaxis], reference.components_, atol=1e-6)
+    np.testing.assert_allclose(scores * signs, reference.transform(data), atol=1e-5)
+
+
+def test_auto_picks_solver_by_shape():
+    assert choose_pca_solver(1_000_000, 50, N_COMPONENTS) in ('covariance_eigh', 'full')
+    assert choose_pca_solver(5_000, 2_000, N_COMPONENTS) == 'randomized'
+    assert choose_pca_solver(100, 8, 7) in ('covariance_eigh', 'full')
+    assert choose_pca_solver(150, 120, 10) == 'full'
+
+
+def test_unknown_solver_is_rejected():
+    with pytest.raises(ValueError):
+        fit_pca(np.eye(5), 2, 'arpack')
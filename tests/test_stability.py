@@ -0,0 +1,66 @@
+"""安定性評価のデータ行列の書き出しと、対応していない結果・分析後に変わったCSVの扱いの確認。"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import pca_stability
+from pca_core import DataError, analyze_csv
+from pca_stability import run_stability
+
+N_ROWS = 1_000
+N_COLUMNS = 6
+
+
+def _write_csv(path, n_rows, seed=0, mode='w'):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.standard_normal((n_rows, N_COLUMNS)) * (1.5 ** -np.arange(N_COLUMNS)),
+                      columns=[f'x{j}' for j in range(N_COLUMNS)])
+    df.insert(0, 'ID', [f'id{i}' for i in range(n_rows)])
+    df.to_csv(path, mode=mode, header=mode == 'w', index=False, float_format='%.4f')
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    _write_csv(path, N_ROWS)
+    return path
+
+
+def test_matrix_is_read_back_from_csv_in_chunks(csv_path, monkeypatch):
+    # 省メモリモードの結果では数値列をCSVからチャンク単位で読み直し、メモリ上の分析と同じ行列になる
+    monkeypatch.setattr(pca_stability, 'MATRIX_CHUNK_ROWS', 300)
+    low = analyze_csv(csv_path, streaming_threshold_bytes=float('inf'), low_memory=True)
+    normal = analyze_csv(csv_path, streaming_threshold_bytes=float('inf'))
+    assert not set(low.numerical_df_columns) <= set(low.df.columns)
+
+    paths = [pca_stability._write_matrix(result, csv_path) for result in (low, normal)]
+    try:
+        low_matrix, normal_matrix = (np.load(path) for path in paths)
+        np.testing.assert_array_equal(low_matrix, normal_matrix)
+        assert low_matrix.shape == (N_ROWS, N_COLUMNS)
+    finally:
+        for path in paths:
+            pca_stability._remove_matrix(path)
+
+
+def test_rows_added_after_analysis_are_rejected(csv_path):
+    result = analyze_csv(csv_path, streaming_threshold_bytes=float('inf'), low_memory=True)
+    _write_csv(csv_path, 10, seed=1, mode='a')
+    with pytest.raises(DataError):
+        run_stability(result, csv_path, n_replicates=2, workers=1)
+
+
+def test_streaming_result_is_rejected(csv_path):
+    result = analyze_csv(csv_path, streaming_threshold_bytes=1)
+    assert result.fit_info['solver'] == 'incremental'
+    assert pca_stability.stability_unsupported_reason(result) is not None
+    with pytest.raises(DataError):
+        run_stability(result, csv_path, n_replicates=2, workers=1)
+    result.release()
+
+
+def test_bootstrap_runs_on_in_memory_result(csv_path):
+    result = analyze_csv(csv_path, streaming_threshold_bytes=float('inf'))
+    stability = run_stability(result, csv_path, n_replicates=4, workers=1)
+    assert stability.ratios.shape == (4, result.pca.n_components_)
+    assert stability.components.shape == (4, result.pca.n_components_, N_COLUMNS)